@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+Temp frame store benchmark
+Reports encode/decode cost and disk footprint of each temp frame format
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import argparse
+
+import cv2
+import numpy
+
+# Add the current directory to the Python path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import modules.globals
+from modules.frame_store import FRAME_STORES, get_frame_store, close_frame_caches
+
+
+def load_sample_frames(video_path, count, width, height):
+    """Load sample frames from a video, or synthesize noisy gradients"""
+    frames = []
+    if video_path:
+        capture = cv2.VideoCapture(video_path)
+        frame_total = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+        for index in range(count):
+            capture.set(cv2.CAP_PROP_POS_FRAMES, index * max(1, frame_total // count))
+            has_frame, frame = capture.read()
+            if has_frame:
+                frames.append(frame)
+        capture.release()
+    if not frames:
+        gradient = numpy.linspace(0, 255, width, dtype=numpy.float32)[numpy.newaxis, :, numpy.newaxis]
+        for _ in range(count):
+            noise = numpy.random.normal(0, 12, (height, width, 3))
+            frames.append(numpy.clip(gradient + noise, 0, 255).astype(numpy.uint8))
+    return frames
+
+
+def benchmark_store(name, frames, directory):
+    """Write and read every sample frame with one store"""
+    frame_store = get_frame_store(name)
+    store_directory = os.path.join(directory, name)
+    os.makedirs(store_directory, exist_ok=True)
+    height, width = frames[0].shape[:2]
+
+    start_time = time.perf_counter()
+    frame_store.write_all(store_directory, frames, width, height)
+    encode_time = time.perf_counter() - start_time
+    paths = frame_store.list_frames(store_directory)
+
+    start_time = time.perf_counter()
+    for path in paths:
+        # the raw store hands out lazy memmap views, touching every pixel makes all stores pay for the read
+        numpy.asarray(frame_store.read(path)).sum()
+    decode_time = time.perf_counter() - start_time
+
+    close_frame_caches()
+    total_bytes = sum(os.path.getsize(os.path.join(store_directory, file_name)) for file_name in os.listdir(store_directory))
+    return {
+        'name': name,
+        'encode_ms': encode_time * 1000 / len(frames),
+        'decode_ms': decode_time * 1000 / len(frames),
+        'frame_mb': total_bytes / len(frames) / (1024 * 1024),
+    }
+
+
+def main():
+    """Main function to run the frame store benchmark"""
+    parser = argparse.ArgumentParser(description="Benchmark temp frame formats")
+    parser.add_argument("--video", help="video to sample frames from (synthetic frames if omitted)")
+    parser.add_argument("--frames", type=int, default=30, help="number of sample frames")
+    parser.add_argument("--width", type=int, default=1920, help="synthetic frame width")
+    parser.add_argument("--height", type=int, default=1080, help="synthetic frame height")
+    parser.add_argument("--png-compression", type=int, default=modules.globals.png_compression, help="png compression level")
+    parser.add_argument("--jpeg-quality", type=int, default=modules.globals.jpeg_quality, help="jpeg quality")
+    parser.add_argument("--directory", help="scratch directory to benchmark (defaults to the system temp directory)")
+    args = parser.parse_args()
+
+    modules.globals.png_compression = args.png_compression
+    modules.globals.jpeg_quality = args.jpeg_quality
+
+    frames = load_sample_frames(args.video, args.frames, args.width, args.height)
+    height, width = frames[0].shape[:2]
+    print(f"🧪 Benchmarking {len(frames)} frames of {width}x{height}")
+    print("=" * 64)
+    print(f"{'format':<8}{'encode ms':>12}{'decode ms':>12}{'MB/frame':>12}{'GB/10k frames':>16}")
+
+    directory = tempfile.mkdtemp(prefix='frame_store_', dir=args.directory)
+    try:
+        for name in FRAME_STORES:
+            result = benchmark_store(name, frames, directory)
+            print(f"{result['name']:<8}{result['encode_ms']:>12.1f}{result['decode_ms']:>12.1f}{result['frame_mb']:>12.2f}{result['frame_mb'] * 10000 / 1024:>16.1f}")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import os
+import json
+import time
+import platform
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import modules.globals
+
+AUTOTUNE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'deep-live-cam', 'autotune.json')
+AUTOTUNE_WINDOW_SECONDS = 5.0
+AUTOTUNE_MIN_WINDOW_FRAMES = 8
+# a change has to beat the best throughput by this much to count as better and not as noise
+AUTOTUNE_TOLERANCE = 0.03
+AUTOTUNE_MAX_WINDOWS = 12
+
+
+class WorkerLimit:
+    """
+    Semaphore whose capacity can change while workers wait on it
+    """
+
+    def __init__(self, limit: int):
+        self.limit = max(1, limit)
+        self.active = 0
+        self.condition = threading.Condition()
+
+    def set_limit(self, limit: int) -> None:
+        with self.condition:
+            self.limit = max(1, limit)
+            self.condition.notify_all()
+
+    @contextmanager
+    def acquire(self) -> Iterator[None]:
+        with self.condition:
+            while self.active >= self.limit:
+                self.condition.wait()
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify()
+
+
+class ThreadAutotuner:
+    """
+    Hill climb the number of active workers on the frames per second of sliding windows
+    """
+
+    def __init__(self, key: str, initial: int, maximum: int, worker_limits: List[WorkerLimit], cached: bool = False):
+        self.key = key
+        self.maximum = max(1, maximum)
+        self.current = min(max(1, initial), self.maximum)
+        self.initial = self.current
+        self.worker_limits = worker_limits
+        # a value from an earlier job is taken as it is, tuning again would only cost throughput
+        self.settled = cached
+        self.best_threads = self.current
+        self.best_fps = 0.0
+        self.direction = 1
+        self.reversed = False
+        self.window_count = 0
+        self.window_frames = 0
+        self.window_start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.apply(self.current)
+
+    def apply(self, threads: int) -> None:
+        self.current = min(max(1, threads), self.maximum)
+        for worker_limit in self.worker_limits:
+            worker_limit.set_limit(self.current)
+
+    def record_frame(self) -> None:
+        if self.settled:
+            return
+        with self.lock:
+            self.window_frames += 1
+            elapsed = time.perf_counter() - self.window_start
+            if elapsed < AUTOTUNE_WINDOW_SECONDS or self.window_frames < AUTOTUNE_MIN_WINDOW_FRAMES:
+                return
+            self.step(self.window_frames / elapsed)
+            self.window_frames = 0
+            self.window_start = time.perf_counter()
+
+    def step(self, fps: float) -> None:
+        self.window_count += 1
+        if fps > self.best_fps * (1 + AUTOTUNE_TOLERANCE):
+            self.best_fps = fps
+            self.best_threads = self.current
+        elif self.reversed or self.best_threads != self.initial:
+            # the other side of the best value is either measured already or was the starting point
+            self.settle()
+            return
+        else:
+            # going this way stopped paying off, try the other side of the starting point once
+            self.reversed = True
+            self.direction = -self.direction
+        next_threads = self.best_threads + self.direction if self.current != self.best_threads else self.current + self.direction
+        if next_threads < 1 or next_threads > self.maximum or self.window_count >= AUTOTUNE_MAX_WINDOWS:
+            self.settle()
+            return
+        self.apply(next_threads)
+
+    def settle(self) -> None:
+        self.settled = True
+        self.apply(self.best_threads)
+        save_autotuned_threads(self.key, self.best_threads)
+        from modules.core import update_status
+
+        update_status(f'Autotuner settled on {self.best_threads} execution threads ({self.best_fps:.2f} frames/s)')
+
+
+def get_autotune_key(frame_processor_names: List[str]) -> str:
+    return '|'.join([platform.node(), str(os.cpu_count()), ','.join(modules.globals.execution_providers), '+'.join(frame_processor_names)])
+
+
+def load_autotune_cache() -> Dict[str, Any]:
+    try:
+        with open(AUTOTUNE_CACHE_PATH) as autotune_cache:
+            return json.load(autotune_cache)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_autotuned_threads(key: str) -> Optional[int]:
+    return load_autotune_cache().get(key)
+
+
+def save_autotuned_threads(key: str, threads: int) -> None:
+    autotune_cache = load_autotune_cache()
+    autotune_cache[key] = threads
+    try:
+        os.makedirs(os.path.dirname(AUTOTUNE_CACHE_PATH), exist_ok=True)
+        with open(AUTOTUNE_CACHE_PATH + '.tmp', 'w') as autotune_cache_file:
+            json.dump(autotune_cache, autotune_cache_file)
+        os.replace(AUTOTUNE_CACHE_PATH + '.tmp', AUTOTUNE_CACHE_PATH)
+    except OSError:
+        pass
+
+
+def get_autotune_maximum() -> int:
+    return max(modules.globals.execution_threads * 2, os.cpu_count() or 1)
+
+
+def create_thread_autotuner(frame_processor_names: List[str], worker_limits: List[WorkerLimit]) -> ThreadAutotuner:
+    key = get_autotune_key(frame_processor_names)
+    cached_threads = load_autotuned_threads(key)
+    maximum = get_autotune_maximum()
+    if cached_threads is not None:
+        return ThreadAutotuner(key, cached_threads, maximum, worker_limits, cached=True)
+    return ThreadAutotuner(key, modules.globals.execution_threads, maximum, worker_limits)
@@ -0,0 +1,137 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Any, Dict, IO, Set
+
+import modules.globals
+from modules.utilities import get_temp_directory_path
+
+MANIFEST_NAME = 'manifest.json'
+JOURNAL_EXTENSION = '.done'
+CHECKPOINT_SETTINGS = [
+    'frame_processors',
+    'many_faces',
+    'face_prescan',
+    'prescan_stride',
+    'prescan_size',
+    'frame_dedup',
+    'dedup_threshold',
+    'color_correction',
+    'mouth_mask',
+    'show_mouth_mask_box',
+    'mask_feather_ratio',
+    'mask_down_size',
+    'mask_size',
+    'temp_frame_format',
+    'png_compression',
+    'jpeg_quality',
+]
+JOURNALS: Dict[str, IO[str]] = {}
+CHECKPOINT_LOCK = threading.Lock()
+
+
+def get_file_signature(path: str) -> Any:
+    if not path or not os.path.isfile(path):
+        return None
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, int(stat.st_mtime)]
+
+
+def get_settings_hash(source_path: str, target_path: str) -> str:
+    settings = {
+        'source': get_file_signature(source_path),
+        'target': get_file_signature(target_path),
+        'settings': {name: getattr(modules.globals, name, None) for name in CHECKPOINT_SETTINGS},
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_manifest_path(target_path: str) -> str:
+    return os.path.join(get_temp_directory_path(target_path), MANIFEST_NAME)
+
+
+def get_journal_path(target_path: str, stage: str) -> str:
+    return os.path.join(get_temp_directory_path(target_path), stage + JOURNAL_EXTENSION)
+
+
+def load_manifest(target_path: str) -> Dict[str, Any]:
+    try:
+        with open(get_manifest_path(target_path)) as manifest:
+            return json.load(manifest)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(target_path: str, manifest: Dict[str, Any]) -> None:
+    manifest_path = get_manifest_path(target_path)
+    with open(manifest_path + '.tmp', 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def can_resume(source_path: str, target_path: str) -> bool:
+    manifest = load_manifest(target_path)
+    return manifest.get('hash') == get_settings_hash(source_path, target_path) and manifest.get('extracted', False)
+
+
+def start_checkpoint(source_path: str, target_path: str) -> None:
+    close_journals()
+    for stage in load_manifest(target_path).get('stages', {}):
+        journal_path = get_journal_path(target_path, stage)
+        if os.path.isfile(journal_path):
+            os.remove(journal_path)
+    save_manifest(target_path, {'hash': get_settings_hash(source_path, target_path), 'extracted': False, 'stages': {}})
+
+
+def has_checkpoint(target_path: str) -> bool:
+    return os.path.isfile(get_manifest_path(target_path))
+
+
+def mark_frames_extracted(target_path: str) -> None:
+    with CHECKPOINT_LOCK:
+        manifest = load_manifest(target_path)
+        manifest['extracted'] = True
+        save_manifest(target_path, manifest)
+
+
+def is_stage_completed(target_path: str, stage: str) -> bool:
+    return load_manifest(target_path).get('stages', {}).get(stage) == 'completed'
+
+
+def mark_stage_completed(target_path: str, stage: str) -> None:
+    with CHECKPOINT_LOCK:
+        journal = JOURNALS.pop(stage, None)
+        if journal:
+            journal.close()
+        manifest = load_manifest(target_path)
+        manifest.setdefault('stages', {})[stage] = 'completed'
+        save_manifest(target_path, manifest)
+
+
+def get_completed_frames(target_path: str, stage: str) -> Set[str]:
+    journal_path = get_journal_path(target_path, stage)
+    if not os.path.isfile(journal_path):
+        return set()
+    with open(journal_path) as journal:
+        return {line.strip() for line in journal if line.strip()}
+
+
+def mark_frame_completed(target_path: str, stage: str, temp_frame_path: str) -> None:
+    with CHECKPOINT_LOCK:
+        if stage not in JOURNALS:
+            manifest = load_manifest(target_path)
+            if stage not in manifest.setdefault('stages', {}):
+                manifest['stages'][stage] = 'started'
+                save_manifest(target_path, manifest)
+            JOURNALS[stage] = open(get_journal_path(target_path, stage), 'a')
+        # one line per frame, flushed so a killed process loses at most the frame in flight
+        JOURNALS[stage].write(os.path.basename(temp_frame_path) + '\n')
+        JOURNALS[stage].flush()
+
+
+def close_journals() -> None:
+    with CHECKPOINT_LOCK:
+        for journal in JOURNALS.values():
+            journal.close()
+        JOURNALS.clear()
@@ -6,7 +6,7 @@ if any(arg.startswith('--execution-provider') for arg in sys.argv):
 # reduce tensorflow log level
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'
 import warnings
-from typing import List
+from typing import Dict, List
 import platform
 import signal
 import shutil
@@ -18,9 +18,19 @@ import tensorflow
 import modules.globals
 import modules.metadata
 import modules.ui as ui
-from modules.processors.frame.core import get_frame_processors_modules
-from modules.utilities import has_image_extension, is_image, is_video, detect_fps, create_video, extract_frames, get_temp_frame_paths, restore_audio, create_temp, move_temp, clean_temp, normalize_output_path
+from modules.processors.frame.core import get_frame_processors_modules, get_fused_stage_name, get_staged_inference_workers, process_video_fused, process_video_stream, process_video_yuv, process_video_draft
+from modules.utilities import has_image_extension, has_gif_extension, is_image, is_video, detect_fps, create_video, extract_frames, get_temp_frame_paths, get_temp_store_status, restore_audio, create_temp, move_temp, clean_temp, normalize_output_path, get_temp_output_path, get_temp_preview_path, get_progressive_encoder_args
 from modules.memory_optimizer import memory_optimizer
+from modules.events import publish_status, start_job
+from modules.metrics import dump_summary
+from modules.tracer import span, start_tracing
+from modules.estimator import estimate_job, format_estimate
+from modules.thread_budget import create_thread_budget, apply_thread_budget
+from modules.gif import process_gif
+from modules.face_presence import build_face_presence_map
+from modules.frame_dedup import find_duplicate_frames, restore_duplicate_frames
+from modules.segments import process_video_segments, process_video_ranges, parse_time_ranges, is_in_time_ranges
+from modules.checkpoint import can_resume, start_checkpoint, has_checkpoint, mark_frames_extracted, is_stage_completed, mark_stage_completed, close_journals
 
 if 'ROCMExecutionProvider' in modules.globals.execution_providers:
     del torch
@@ -28,6 +38,9 @@ if 'ROCMExecutionProvider' in modules.globals.execution_providers:
 warnings.filterwarnings('ignore', category=FutureWarning, module='insightface')
 warnings.filterwarnings('ignore', category=UserWarning, module='torchvision')
 
+# stages of the staged frame pipeline whose workers can be set one by one
+STAGE_NAMES = ['detect', 'face_swapper', 'face_enhancer']
+
 
 def parse_args() -> None:
     signal.signal(signal.SIGINT, lambda signal_number, frame: destroy())
@@ -39,11 +52,36 @@ def parse_args() -> None:
     program.add_argument('--keep-fps', help='keep original fps', dest='keep_fps', action='store_true', default=False)
     program.add_argument('--keep-audio', help='keep original audio', dest='keep_audio', action='store_true', default=True)
     program.add_argument('--keep-frames', help='keep temporary frames', dest='keep_frames', action='store_true', default=False)
+    program.add_argument('--video-segments', help='split videos at keyframes and process each segment in its own process', dest='video_segments', type=int, default=1)
+    program.add_argument('--no-checkpoint', help='do not keep a checkpoint to resume interrupted videos', dest='checkpoint', action='store_false', default=True)
+    program.add_argument('--start', help='start time of the video range to process (seconds or HH:MM:SS)', dest='start_time')
+    program.add_argument('--end', help='end time of the video range to process (seconds or HH:MM:SS)', dest='end_time')
+    program.add_argument('--ranges', help='comma separated video ranges to process, e.g. 10-30,1:00-1:15', dest='ranges')
+    program.add_argument('--temp-frame-format', help='image format used for temporary frames', dest='temp_frame_format', default='png', choices=['png', 'bmp', 'jpg', 'npy', 'raw'])
+    program.add_argument('--png-compression', help='compression level of temporary png frames', dest='png_compression', type=int, default=1, choices=range(10), metavar='[0-9]')
+    program.add_argument('--jpeg-quality', help='quality of temporary jpg frames', dest='jpeg_quality', type=int, default=95, choices=range(1, 101), metavar='[1-100]')
+    program.add_argument('--temp-store', help='keep temporary frames on disk or in a tmpfs, spilling to disk past the budget', dest='temp_store', default='disk', choices=['disk', 'ram'])
+    program.add_argument('--temp-ram-path', help='tmpfs directory used by the ram temp store', dest='temp_ram_path', default='/dev/shm')
+    program.add_argument('--temp-ram-budget', help='amount of temporary frames in GB kept in the tmpfs', dest='temp_ram_budget', type=float, default=4.0)
     program.add_argument('--many-faces', help='process every face', dest='many_faces', action='store_true', default=False)
+    program.add_argument('--face-prescan', help='skip every processor on frames where a low resolution scan finds no face', dest='face_prescan', action='store_true', default=False)
+    program.add_argument('--prescan-stride', help='scan every k-th frame and fill the frames in between', dest='prescan_stride', type=int, default=1)
+    program.add_argument('--prescan-size', help='detector input size of the face scan', dest='prescan_size', type=int, default=320)
+    program.add_argument('--dedup-frames', help='reuse the result of near identical frames', dest='frame_dedup', action='store_true', default=False)
+    program.add_argument('--dedup-threshold', help='largest mean pixel difference of any frame region under which frames count as duplicates', dest='dedup_threshold', type=float, default=0.5)
     program.add_argument('--nsfw-filter', help='filter the NSFW image or video', dest='nsfw_filter', action='store_true', default=False)
     program.add_argument('--map-faces', help='map source target faces', dest='map_faces', action='store_true', default=False)
     program.add_argument('--video-encoder', help='adjust output video encoder', dest='video_encoder', default='libx264', choices=['libx264', 'libx265', 'libvpx-vp9'])
     program.add_argument('--video-quality', help='adjust output video quality', dest='video_quality', type=int, default=18, choices=range(52), metavar='[0-51]')
+    program.add_argument('--draft', help='render a fast low resolution preview of the whole video', dest='draft', action='store_true', default=False)
+    program.add_argument('--draft-height', help='frame height of the draft', dest='draft_height', type=int, default=360)
+    program.add_argument('--draft-stride', help='process every n-th frame of the draft', dest='draft_stride', type=int, default=4)
+    program.add_argument('--draft-fill', help='fill the frames in between with the last processed frame or a blend', dest='draft_fill', default='repeat', choices=['repeat', 'blend'])
+    program.add_argument('--progressive-output', help='write a fragmented mp4 that is playable while the video is processed', dest='progressive_output', action='store_true', default=False)
+    program.add_argument('--preview-rendition', help='also write a small fast start preview next to the output video', dest='preview_rendition', action='store_true', default=False)
+    program.add_argument('--preview-height', help='maximum height of the preview rendition', dest='preview_height', type=int, default=480)
+    program.add_argument('--preview-bitrate', help='video bitrate of the preview rendition', dest='preview_bitrate', default='600k')
+    program.add_argument('--video-pipeline', help='process videos through temp frames, an in-memory ffmpeg stream or a yuv stream converting only faces', dest='video_pipeline', default='frames', choices=['frames', 'stream', 'yuv'])
     program.add_argument('--live-mirror', help='The live camera display as you see it in the front-facing camera frame', dest='live_mirror', action='store_true', default=False)
     program.add_argument('--live-resizable', help='The live camera frame is resizable', dest='live_resizable', action='store_true', default=False)
     program.add_argument('--max-memory', help='maximum amount of RAM in GB', dest='max_memory', type=int, default=suggest_max_memory())
@@ -51,6 +89,18 @@ def parse_args() -> None:
     program.add_argument('--enable-memory-optimization', help='enable advanced memory optimization', dest='enable_memory_optimization', action='store_true', default=True)
     program.add_argument('--execution-provider', help='execution provider', dest='execution_provider', default=['cpu'], choices=suggest_execution_providers(), nargs='+')
     program.add_argument('--execution-threads', help='number of execution threads', dest='execution_threads', type=int, default=suggest_execution_threads())
+    program.add_argument('--execution-mode', help='run frame workers as threads or as processes with their own models', dest='execution_mode', default='thread', choices=['thread', 'process'])
+    program.add_argument('--autotune-threads', help='tune the number of execution threads on measured throughput and remember it', dest='autotune_threads', action='store_true', default=False)
+    program.add_argument('--read-threads', help='number of threads reading temp frames', dest='read_threads', type=int, default=2)
+    program.add_argument('--write-threads', help='number of threads writing temp frames', dest='write_threads', type=int, default=2)
+    program.add_argument('--stage-threads', help='workers of a pipeline stage as STAGE=COUNT, stages are detect, face_swapper and face_enhancer, the others run execution threads', dest='stage_threads', default=[], nargs='+')
+    program.add_argument('--frame-queue-size', help='number of frames buffered between pipeline stages', dest='frame_queue_size', type=int, default=16)
+    program.add_argument('--thread-budget', help='split the cores between frame workers, onnxruntime, opencv and torch or leave every library its own default', dest='thread_budget', default='auto', choices=['auto', 'off'])
+    program.add_argument('--cpu-affinity', help='pin each worker process to its share of the cores', dest='cpu_affinity', action='store_true', default=False)
+    program.add_argument('--ort-spinning', help='let idle onnxruntime threads spin for work', dest='ort_spinning', default='auto', choices=['auto', 'on', 'off'])
+    program.add_argument('--metrics-output', help='write the stage timings of a headless run as json to this path instead of printing them', dest='metrics_output', default=None)
+    program.add_argument('--trace', help='record a chrome trace of the frame stages, locks, gc pauses and ffmpeg calls to this path', dest='trace_path', default=None)
+    program.add_argument('--estimate', help='run the processors on a few sample frames, report the expected time, temp frames and memory and exit, needs -s and -t', dest='estimate', action='store_true', default=False)
     program.add_argument('--web', help='run as web interface', dest='web_mode', action='store_true', default=False)
     program.add_argument('-v', '--version', action='version', version=f'{modules.metadata.name} {modules.metadata.version}')
 
@@ -67,19 +117,64 @@ def parse_args() -> None:
     modules.globals.output_path = normalize_output_path(modules.globals.source_path, modules.globals.target_path, args.output_path)
     modules.globals.frame_processors = args.frame_processor
     modules.globals.headless = args.source_path or args.target_path or args.output_path
+    if args.estimate and not (args.source_path and args.target_path):
+        # the ui has no estimate step, the web ui estimates through its own estimate option
+        program.error('--estimate needs --source and --target')
     modules.globals.keep_fps = args.keep_fps
     modules.globals.keep_audio = args.keep_audio
     modules.globals.keep_frames = args.keep_frames
+    modules.globals.checkpoint = args.checkpoint
+    modules.globals.temp_frame_format = args.temp_frame_format
+    modules.globals.png_compression = args.png_compression
+    modules.globals.jpeg_quality = args.jpeg_quality
+    modules.globals.temp_store = args.temp_store
+    modules.globals.temp_ram_path = args.temp_ram_path
+    modules.globals.temp_ram_budget = args.temp_ram_budget
     modules.globals.many_faces = args.many_faces
+    modules.globals.face_prescan = args.face_prescan
+    modules.globals.prescan_stride = args.prescan_stride
+    modules.globals.prescan_size = args.prescan_size
+    modules.globals.frame_dedup = args.frame_dedup
+    modules.globals.dedup_threshold = args.dedup_threshold
     modules.globals.nsfw_filter = args.nsfw_filter
     modules.globals.map_faces = args.map_faces
     modules.globals.video_encoder = args.video_encoder
     modules.globals.video_quality = args.video_quality
+    modules.globals.video_pipeline = args.video_pipeline
+    modules.globals.draft = args.draft
+    modules.globals.draft_height = args.draft_height
+    modules.globals.draft_stride = args.draft_stride
+    modules.globals.draft_fill = args.draft_fill
+    modules.globals.progressive_output = args.progressive_output
+    # the web ui serves the preview by default, so always render it there
+    modules.globals.preview_rendition = args.preview_rendition or args.web_mode
+    modules.globals.preview_height = args.preview_height
+    modules.globals.preview_bitrate = args.preview_bitrate
+    modules.globals.video_segments = max(1, args.video_segments)
+    try:
+        modules.globals.video_ranges = parse_time_ranges(args.start_time, args.end_time, args.ranges)
+    except ValueError as exception:
+        program.error(f'invalid time range: {exception}')
     modules.globals.live_mirror = args.live_mirror
     modules.globals.live_resizable = args.live_resizable
     modules.globals.max_memory = args.max_memory
     modules.globals.execution_providers = decode_execution_providers(args.execution_provider)
     modules.globals.execution_threads = args.execution_threads
+    modules.globals.execution_mode = args.execution_mode
+    modules.globals.autotune_threads = args.autotune_threads
+    modules.globals.read_threads = args.read_threads
+    modules.globals.write_threads = args.write_threads
+    try:
+        modules.globals.stage_threads = parse_stage_threads(args.stage_threads)
+    except ValueError as exception:
+        program.error(f'invalid stage threads: {exception}')
+    modules.globals.frame_queue_size = args.frame_queue_size
+    modules.globals.thread_budget = args.thread_budget
+    modules.globals.cpu_affinity = args.cpu_affinity
+    modules.globals.ort_spinning = args.ort_spinning
+    modules.globals.metrics_output = args.metrics_output
+    modules.globals.trace_path = args.trace_path
+    modules.globals.estimate = args.estimate
     modules.globals.web_mode = args.web_mode
     
     # Configure memory optimizer with user settings
@@ -133,6 +228,18 @@ def suggest_execution_providers() -> List[str]:
     return encode_execution_providers(onnxruntime.get_available_providers())
 
 
+def parse_stage_threads(stage_threads: List[str]) -> Dict[str, int]:
+    stage_workers = {}
+    for stage_thread in stage_threads:
+        stage, _, count = stage_thread.partition('=')
+        if stage not in STAGE_NAMES:
+            raise ValueError(f'unknown stage {stage}')
+        if int(count) < 1:
+            raise ValueError(f'{stage} needs at least one worker')
+        stage_workers[stage] = int(count)
+    return stage_workers
+
+
 def suggest_execution_threads() -> int:
     if 'DmlExecutionProvider' in modules.globals.execution_providers:
         return 1
@@ -141,9 +248,26 @@ def suggest_execution_threads() -> int:
     return 8
 
 
+def uses_stream_pipeline() -> bool:
+    return (modules.globals.video_pipeline in ('stream', 'yuv') or modules.globals.draft or modules.globals.progressive_output or modules.globals.video_segments > 1 or modules.globals.video_ranges) and not modules.globals.map_faces
+
+
+def get_inference_workers() -> int:
+    # streams, mapped faces and worker processes run every frame through the whole chain on one worker
+    if modules.globals.execution_mode == 'process' or modules.globals.map_faces or uses_stream_pipeline():
+        return modules.globals.execution_threads
+    return get_staged_inference_workers(get_frame_processors_modules(modules.globals.frame_processors))
+
+
 def limit_resources() -> None:
     # Apply advanced memory optimizations
     memory_optimizer.optimize_for_inference()
+
+    if modules.globals.thread_budget == 'auto':
+        # the sessions take their threads when the models load, so the budget is split for the pipeline that will run
+        thread_budget = create_thread_budget(get_inference_workers())
+        apply_thread_budget(thread_budget)
+        update_status(f'Thread budget {thread_budget.describe()}')
     
     # Traditional memory limit (kept for compatibility)
     if modules.globals.max_memory:
@@ -161,7 +285,8 @@ def limit_resources() -> None:
 
 def release_resources() -> None:
     # Use advanced memory cache clearing
-    memory_optimizer.clear_memory_cache()
+    with span('release_resources', 'gc'):
+        memory_optimizer.clear_memory_cache()
 
 
 def pre_check() -> bool:
@@ -176,13 +301,13 @@ def pre_check() -> bool:
 
 def update_status(message: str, scope: str = 'DLC.CORE') -> None:
     print(f'[{scope}] {message}')
-    if not modules.globals.headless:
-        ui.update_status(message)
+    publish_status(message, scope)
 
 def start() -> None:
     for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
         if not frame_processor.pre_start():
             return
+    start_job()
     update_status('Processing...')
     # process image to image
     if has_image_extension(modules.globals.target_path):
@@ -201,30 +326,98 @@ def start() -> None:
         else:
             update_status('Processing to image failed!')
         return
+    # process gif in memory
+    if has_gif_extension(modules.globals.target_path) and not modules.globals.map_faces:
+        if modules.globals.nsfw_filter and ui.check_and_ignore_nsfw(modules.globals.target_path, destroy):
+            return
+        update_status('Processing gif in memory...')
+        if process_gif(modules.globals.source_path, modules.globals.target_path, modules.globals.output_path, get_frame_processors_modules(modules.globals.frame_processors)):
+            update_status('Processing to gif succeed!')
+        else:
+            update_status('Processing to gif failed!')
+        release_resources()
+        return
     # process image to videos
     if modules.globals.nsfw_filter and ui.check_and_ignore_nsfw(modules.globals.target_path, destroy):
         return
 
-    if not modules.globals.map_faces:
+    # process video through ffmpeg pipes without temp frames
+    if uses_stream_pipeline():
+        start_stream()
+        return
+
+    use_checkpoint = modules.globals.checkpoint and not modules.globals.map_faces
+    if use_checkpoint and can_resume(modules.globals.source_path, modules.globals.target_path):
+        update_status('Resuming from checkpoint...')
+    elif not modules.globals.map_faces:
         update_status('Creating temp resources...')
         create_temp(modules.globals.target_path)
+        if use_checkpoint:
+            start_checkpoint(modules.globals.source_path, modules.globals.target_path)
         update_status('Extracting frames...')
         extract_frames(modules.globals.target_path)
+        if use_checkpoint:
+            mark_frames_extracted(modules.globals.target_path)
+        update_status(get_temp_store_status(modules.globals.target_path))
 
     temp_frame_paths = get_temp_frame_paths(modules.globals.target_path)
-    for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
-        update_status('Progressing...', frame_processor.NAME)
-        frame_processor.process_video(modules.globals.source_path, temp_frame_paths)
-        release_resources()
+    duplicate_frames = {}
+    if modules.globals.frame_dedup:
+        update_status('Detecting duplicate frames...')
+        duplicate_frames = find_duplicate_frames(temp_frame_paths)
+        temp_frame_paths = [temp_frame_path for temp_frame_path in temp_frame_paths if temp_frame_path not in duplicate_frames]
+        update_status(f'{len(duplicate_frames)} duplicate frames will reuse processed results')
+    if modules.globals.face_prescan:
+        update_status('Scanning frames for faces...')
+        face_presence = build_face_presence_map(temp_frame_paths)
+        frame_total = len(temp_frame_paths)
+        temp_frame_paths = [temp_frame_path for temp_frame_path in temp_frame_paths if face_presence[temp_frame_path]]
+        update_status(f'{frame_total - len(temp_frame_paths)} of {frame_total} frames have no face and bypass the processors')
+    frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
+    if modules.globals.map_faces:
+        for frame_processor in frame_processors:
+            update_status('Progressing...', frame_processor.NAME)
+            try:
+                frame_processor.process_video(modules.globals.source_path, temp_frame_paths)
+            except RuntimeError as exception:
+                update_status(f'Processing frames failed: {exception}', frame_processor.NAME)
+                release_resources()
+                return
+            release_resources()
+    else:
+        # every frame is read and written once for the whole processor chain
+        stage = get_fused_stage_name(frame_processors)
+        if use_checkpoint and is_stage_completed(modules.globals.target_path, stage):
+            update_status('Skipping completed processors...')
+        else:
+            update_status('Progressing...', ' + '.join(frame_processor.NAME for frame_processor in frame_processors))
+            if not process_video_fused(modules.globals.source_path, temp_frame_paths, frame_processors):
+                # the stage stays open, a resume picks up the frames that are not in the journal
+                update_status('Processing frames failed!')
+                release_resources()
+                return
+            if use_checkpoint:
+                mark_stage_completed(modules.globals.target_path, stage)
+            release_resources()
+    if duplicate_frames:
+        restore_duplicate_frames(duplicate_frames)
+        update_status(f'Reused processed results for {len(duplicate_frames)} duplicate frames')
     # handles fps
     if modules.globals.keep_fps:
         update_status('Detecting fps...')
         fps = detect_fps(modules.globals.target_path)
         update_status(f'Creating video with {fps} fps...')
-        create_video(modules.globals.target_path, fps)
+        created = create_video(modules.globals.target_path, fps)
     else:
         update_status('Creating video with 30.0 fps...')
-        create_video(modules.globals.target_path)
+        created = create_video(modules.globals.target_path)
+    if not created:
+        # the processed frames stay for a resume when there is a checkpoint
+        close_journals()
+        if not use_checkpoint:
+            clean_temp(modules.globals.target_path)
+        update_status('Processing to video failed!')
+        return
     # handle audio
     if modules.globals.keep_audio:
         if modules.globals.keep_fps:
@@ -235,6 +428,7 @@ def start() -> None:
     else:
         move_temp(modules.globals.target_path, modules.globals.output_path)
     # clean and validate
+    close_journals()
     clean_temp(modules.globals.target_path)
     if is_video(modules.globals.target_path):
         update_status('Processing to video succeed!')
@@ -242,22 +436,90 @@ def start() -> None:
         update_status('Processing to video failed!')
 
 
+def start_stream() -> None:
+    update_status('Creating temp resources...')
+    create_temp(modules.globals.target_path)
+    fps = 30.0
+    if modules.globals.keep_fps:
+        update_status('Detecting fps...')
+        fps = detect_fps(modules.globals.target_path)
+    if modules.globals.keep_audio and not modules.globals.keep_fps:
+        update_status('Restoring audio might cause issues as fps are not kept...')
+    temp_output_path = get_temp_output_path(modules.globals.target_path)
+    audio_path = modules.globals.target_path if modules.globals.keep_audio else None
+    preview_path = get_temp_preview_path(modules.globals.target_path)
+    encoder_args = None
+    if modules.globals.progressive_output:
+        if modules.globals.video_ranges or modules.globals.video_segments > 1:
+            update_status('Progressive output is not available for ranges or segments, the output is written at the end...')
+        encoder_args = get_progressive_encoder_args(fps)
+    frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
+    if modules.globals.draft:
+        update_status(f'Rendering draft, processing 1 of every {modules.globals.draft_stride} frames...')
+        processed = process_video_draft(modules.globals.source_path, modules.globals.target_path, temp_output_path, fps, frame_processors, audio_path)
+    elif modules.globals.video_ranges:
+        update_status('Processing video ranges...')
+        processed = process_video_ranges(modules.globals.source_path, modules.globals.target_path, temp_output_path, modules.globals.video_ranges)
+        if not processed:
+            update_status('Video cannot be spliced, re-encoding it with only the ranges processed...')
+            fps = detect_fps(modules.globals.target_path)
+            processed = process_video_stream(modules.globals.source_path, modules.globals.target_path, temp_output_path, fps, frame_processors, audio_path, encoder_args, frame_filter=lambda frame_number: is_in_time_ranges(frame_number, fps, modules.globals.video_ranges), preview_path=preview_path)
+    elif modules.globals.video_segments > 1:
+        update_status(f'Processing video in {modules.globals.video_segments} segments with {fps} fps...')
+        processed = process_video_segments(modules.globals.source_path, modules.globals.target_path, temp_output_path, fps, modules.globals.video_segments)
+    else:
+        update_status(f'Streaming video with {fps} fps...')
+        process_video = process_video_yuv if modules.globals.video_pipeline == 'yuv' else process_video_stream
+        processed = process_video(modules.globals.source_path, modules.globals.target_path, temp_output_path, fps, frame_processors, audio_path, encoder_args, preview_path=preview_path)
+    release_resources()
+    if not processed:
+        # a failed encode leaves a partial output behind, it must not replace anything
+        clean_temp(modules.globals.target_path)
+        update_status('Processing to video failed!')
+        return
+    move_temp(modules.globals.target_path, modules.globals.output_path)
+    clean_temp(modules.globals.target_path)
+    if is_video(modules.globals.target_path):
+        update_status('Processing to video succeed!')
+    else:
+        update_status('Processing to video failed!')
+
+
+def estimate() -> None:
+    frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
+    for frame_processor in frame_processors:
+        if not frame_processor.pre_start():
+            return
+    update_status('Estimating...')
+    job_estimate = estimate_job(modules.globals.source_path, modules.globals.target_path, frame_processors)
+    for line in format_estimate(job_estimate):
+        update_status(line)
+
+
 def destroy(to_quit=True) -> None:
-    if modules.globals.target_path:
+    close_journals()
+    if modules.globals.target_path and modules.globals.checkpoint and has_checkpoint(modules.globals.target_path):
+        update_status('Keeping temp resources to resume later...')
+    elif modules.globals.target_path:
         clean_temp(modules.globals.target_path)
     if to_quit: quit()
 
 
 def run() -> None:
     parse_args()
+    if modules.globals.trace_path:
+        start_tracing(modules.globals.trace_path)
     if not pre_check():
         return
     for frame_processor in get_frame_processors_modules(modules.globals.frame_processors):
         if not frame_processor.pre_check():
             return
     limit_resources()
-    if modules.globals.headless:
+    if modules.globals.headless and modules.globals.estimate:
+        estimate()
+    elif modules.globals.headless:
         start()
+        dump_summary(modules.globals.metrics_output)
     elif hasattr(modules.globals, 'web_mode') and modules.globals.web_mode:
         import modules.web_ui as web_ui
         web_ui.init_web(start, destroy)
@@ -0,0 +1,185 @@
+import os
+import sys
+import time
+import shutil
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from typing import Any, Dict, List, Optional
+
+import cv2
+import psutil
+
+import modules.globals
+from modules.capturer import get_video_frame
+from modules.custom_types import Frame
+from modules.face_analyser import get_many_faces
+from modules.frame_context import FrameContext, use_frame_context
+from modules.frame_store import get_frame_store
+from modules.gif import read_gif, get_gif_frame_count
+from modules.probe import probe_media
+from modules.utilities import has_gif_extension, is_image
+
+ESTIMATE_SAMPLE_COUNT = 8
+# image formats whose size depends on the content, the others store the pixels as they are
+ENCODED_FRAME_EXTENSIONS = ('.png', '.bmp', '.jpg')
+
+
+def get_sample_frame_numbers(frame_total: int, sample_count: int) -> List[int]:
+    # spread the samples over the whole video, the middle of each slice avoids intros and black ends
+    sample_count = max(1, min(sample_count, frame_total))
+    return sorted({int((index + 0.5) * frame_total / sample_count) + 1 for index in range(sample_count)})
+
+
+def get_frame_total(target_path: str) -> int:
+    # gifs are images to the mimetypes but animated ones hold many frames
+    if has_gif_extension(target_path):
+        return max(1, get_gif_frame_count(target_path))
+    if is_image(target_path):
+        return 1
+    return max(1, probe_media(target_path)['frame_count'])
+
+
+def read_sample_frames(target_path: str, frame_total: int, sample_count: int) -> List[Frame]:
+    if has_gif_extension(target_path):
+        # opencv cannot read gifs, they are decoded the way the gif processing does it
+        gif_frames, _, _ = read_gif(target_path)
+        sample_frames = [gif_frames[frame_number - 1] for frame_number in get_sample_frame_numbers(len(gif_frames), sample_count)] if gif_frames else []
+    elif is_image(target_path):
+        sample_frames = [cv2.imread(target_path)]
+    else:
+        sample_frames = [get_video_frame(target_path, frame_number) for frame_number in get_sample_frame_numbers(frame_total, sample_count)]
+    return [sample_frame for sample_frame in sample_frames if sample_frame is not None]
+
+
+def get_rss() -> int:
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def get_vram_used() -> Optional[int]:
+    # the device wide figure, onnxruntime allocates outside of torch and would be missing otherwise
+    torch = sys.modules.get('torch')
+    if torch is None or not torch.cuda.is_available():
+        return None
+    free, total = torch.cuda.mem_get_info()
+    return total - free
+
+
+def get_temp_frame_size(sample_frame: Frame) -> int:
+    frame_store = get_frame_store()
+    if frame_store.extension in ENCODED_FRAME_EXTENSIONS:
+        return len(cv2.imencode(frame_store.extension, sample_frame, frame_store.get_write_params())[1])
+    return sample_frame.nbytes
+
+
+def run_sample_frame(frame_processors: List[ModuleType], source_face: Any, sample_frame: Frame) -> Dict[str, Any]:
+    started = time.perf_counter()
+    with use_frame_context(FrameContext()):
+        faces = get_many_faces(sample_frame) or []
+        for frame_processor in frame_processors:
+            sample_frame = frame_processor.process_frame(source_face, sample_frame)
+    return {'seconds': time.perf_counter() - started, 'faces': len(faces), 'frame': sample_frame}
+
+
+def recommend_execution_threads(seconds_per_frame: float, frames_per_second: float, execution_threads: int) -> int:
+    # the speedup the workers reached over a single frame at a time tells how many of them pay off
+    speedup = seconds_per_frame * frames_per_second
+    efficiency = speedup / execution_threads
+    if efficiency < 0.5:
+        return max(1, round(speedup) + 1)
+    if efficiency > 0.8:
+        return max(execution_threads, min(execution_threads * 2, os.cpu_count() or execution_threads))
+    return execution_threads
+
+
+def recommend_temp_store(temp_disk_bytes: int, target_path: str) -> Dict[str, str]:
+    if modules.globals.video_pipeline != 'frames' or not temp_disk_bytes:
+        return {'temp_store': modules.globals.temp_store, 'video_pipeline': modules.globals.video_pipeline}
+    ram_temp_path = modules.globals.temp_ram_path
+    if ram_temp_path and os.path.isdir(ram_temp_path):
+        ram_free = shutil.disk_usage(ram_temp_path).free * 0.9
+        if temp_disk_bytes <= min(ram_free, modules.globals.temp_ram_budget * 1024 ** 3):
+            return {'temp_store': 'ram', 'video_pipeline': 'frames'}
+    disk_free = shutil.disk_usage(os.path.dirname(os.path.abspath(target_path))).free
+    if temp_disk_bytes > disk_free * 0.9:
+        # the temp frames do not fit anywhere, streaming needs no temp frames at all
+        return {'temp_store': 'disk', 'video_pipeline': 'stream'}
+    return {'temp_store': 'disk', 'video_pipeline': 'frames'}
+
+
+def estimate_job(source_path: str, target_path: str, frame_processors: List[ModuleType], sample_count: int = ESTIMATE_SAMPLE_COUNT) -> Dict[str, Any]:
+    """
+    Run the processor chain on a few frames spread over the target and extrapolate time, temp frames and memory
+    """
+    from modules.processors.frame.core import get_source_face, run_frame_processors
+
+    frame_total = get_frame_total(target_path)
+    execution_threads = max(1, modules.globals.execution_threads or 1)
+    sample_frames = read_sample_frames(target_path, frame_total, max(sample_count, execution_threads))
+    if not sample_frames:
+        raise ValueError(f'no frames could be read from {target_path}')
+
+    # the first frame loads the models, it is the startup cost and not the cost per frame
+    started = time.perf_counter()
+    source_face = get_source_face(source_path)
+    run_sample_frame(frame_processors, source_face, sample_frames[0].copy())
+    startup_seconds = time.perf_counter() - started
+
+    peak_rss = get_rss()
+    results = []
+    for sample_frame in sample_frames:
+        # processors may paste into the frame they get, the samples stay untouched for the next pass
+        results.append(run_sample_frame(frame_processors, source_face, sample_frame.copy()))
+        peak_rss = max(peak_rss, get_rss())
+    seconds_per_frame = statistics.median(result['seconds'] for result in results)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=execution_threads) as executor:
+        list(executor.map(lambda sample_frame: run_frame_processors(frame_processors, source_face, sample_frame.copy()), sample_frames))
+    frames_per_second = len(sample_frames) / max(time.perf_counter() - started, 1e-6)
+    peak_rss = max(peak_rss, get_rss())
+
+    frame_bytes = sample_frames[0].nbytes
+    temp_frame_bytes = statistics.mean(get_temp_frame_size(result['frame']) for result in results)
+    # images and gifs are processed in memory, only videos go through temp frames
+    temp_disk_bytes = int(temp_frame_bytes * frame_total) if modules.globals.video_pipeline == 'frames' and not is_image(target_path) else 0
+    # frames waiting between the read, detect, processor and write stages of the pipeline
+    buffered_frames = modules.globals.frame_queue_size * (len(frame_processors) + 3)
+    return {
+        'target_path': target_path,
+        'frame_total': frame_total,
+        'sample_count': len(sample_frames),
+        'startup_seconds': round(startup_seconds, 3),
+        'seconds_per_frame': round(seconds_per_frame, 4),
+        'frames_per_second': round(frames_per_second, 3),
+        'faces_per_frame': round(statistics.mean(result['faces'] for result in results), 2),
+        'wall_seconds': round(startup_seconds + frame_total / frames_per_second, 1),
+        'temp_disk_bytes': temp_disk_bytes,
+        'ram_bytes': peak_rss + frame_bytes * buffered_frames,
+        'vram_bytes': get_vram_used(),
+        'recommended': {
+            'execution_threads': recommend_execution_threads(seconds_per_frame, frames_per_second, execution_threads),
+            **recommend_temp_store(temp_disk_bytes, target_path)
+        }
+    }
+
+
+def format_bytes(size: Optional[int]) -> str:
+    if size is None:
+        return 'n/a'
+    return f'{size / 1024 ** 3:.2f} GB'
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours:d}:{minutes:02d}:{seconds:02d}'
+
+
+def format_estimate(estimate: Dict[str, Any]) -> List[str]:
+    recommended = estimate['recommended']
+    return [
+        f'Estimate from {estimate["sample_count"]} of {estimate["frame_total"]} frames: {estimate["seconds_per_frame"]:.3f}s per frame, {estimate["frames_per_second"]:.2f} frames/s with {modules.globals.execution_threads} threads, {estimate["faces_per_frame"]:.1f} faces per frame',
+        f'Estimated wall time {format_duration(estimate["wall_seconds"])}, temp frames {format_bytes(estimate["temp_disk_bytes"])}, RAM {format_bytes(estimate["ram_bytes"])}, VRAM {format_bytes(estimate["vram_bytes"])}',
+        f'Recommended --execution-threads {recommended["execution_threads"]} --temp-store {recommended["temp_store"]} --video-pipeline {recommended["video_pipeline"]}'
+    ]
@@ -0,0 +1,88 @@
+import time
+import threading
+from itertools import count
+from typing import Any, Callable, List
+
+Listener = Callable[[Any], None]
+
+LISTENERS: List[Listener] = []
+LISTENERS_LOCK = threading.Lock()
+JOB_IDS = count(1)
+JOB_ID = 0
+
+
+class StatusEvent:
+    """
+    Status message of a job, the scope names the module that sent it
+    """
+
+    def __init__(self, job_id: int, scope: str, message: str):
+        self.job_id = job_id
+        self.scope = scope
+        self.message = message
+        self.timestamp = time.time()
+
+
+class ProgressEvent:
+    """
+    Frame progress of one stage of a job, listeners derive whatever they display from the counts and timings
+    """
+
+    def __init__(self, job_id: int, stage: str, frame_index: int, frame_total: int, elapsed: float, reused: int = 0):
+        self.job_id = job_id
+        self.stage = stage
+        self.frame_index = frame_index
+        self.frame_total = frame_total
+        self.elapsed = elapsed
+        self.reused = reused
+        self.timestamp = time.time()
+
+    @property
+    def percentage(self) -> int:
+        return int(self.frame_index * 100 / self.frame_total) if self.frame_total > 0 else 0
+
+    @property
+    def seconds_per_frame(self) -> float:
+        return self.elapsed / self.frame_index if self.frame_index > 0 else 0.0
+
+    @property
+    def remaining(self) -> float:
+        return (self.frame_total - self.frame_index) * self.seconds_per_frame
+
+
+def subscribe(listener: Listener) -> None:
+    with LISTENERS_LOCK:
+        if listener not in LISTENERS:
+            LISTENERS.append(listener)
+
+
+def unsubscribe(listener: Listener) -> None:
+    with LISTENERS_LOCK:
+        if listener in LISTENERS:
+            LISTENERS.remove(listener)
+
+
+def publish(event: Any) -> None:
+    with LISTENERS_LOCK:
+        listeners = list(LISTENERS)
+    for listener in listeners:
+        try:
+            listener(event)
+        except Exception as exception:
+            # a broken listener must not take the processing thread down with it
+            print(exception)
+
+
+def start_job() -> int:
+    global JOB_ID
+
+    JOB_ID = next(JOB_IDS)
+    return JOB_ID
+
+
+def get_job_id() -> int:
+    return JOB_ID
+
+
+def publish_status(message: str, scope: str) -> None:
+    publish(StatusEvent(get_job_id(), scope, message))
@@ -1,13 +1,23 @@
 import os
+import glob
 import shutil
 from typing import Any
-import insightface
+from insightface.app import FaceAnalysis
+from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+from insightface.model_zoo.attribute import Attribute
+from insightface.model_zoo.inswapper import INSwapper
+from insightface.model_zoo.landmark import Landmark
+from insightface.model_zoo.retinaface import RetinaFace
+from insightface.utils import ensure_available
 
 import cv2
 import numpy as np
 import modules.globals
 from tqdm import tqdm
 from modules.custom_types import Frame
+from modules.frame_store import read_frame
+from modules.frame_context import get_frame_context
+from modules.metrics import measure
 from modules.cluster_analysis import find_cluster_centroids, find_closest_centroid
 from modules.utilities import get_temp_directory_path, create_temp, extract_frames, clean_temp, get_temp_frame_paths
 from modules.memory_optimizer import memory_optimizer
@@ -16,40 +26,72 @@ from pathlib import Path
 FACE_ANALYSER = None
 
 
+def load_onnx_model(model_path: str) -> Any:
+    """
+    Build the insightface model for an onnx file around a session of our own, insightface would drop the session options
+    """
+    session = memory_optimizer.create_onnx_session(model_path)
+    inputs = session.get_inputs()
+    input_shape = inputs[0].shape
+    # the same choice insightface makes in its model router
+    if len(session.get_outputs()) >= 5:
+        return RetinaFace(model_file=model_path, session=session)
+    if input_shape[2] == 192 and input_shape[3] == 192:
+        return Landmark(model_file=model_path, session=session)
+    if input_shape[2] == 96 and input_shape[3] == 96:
+        return Attribute(model_file=model_path, session=session)
+    if len(inputs) == 2 and input_shape[2] == 128 and input_shape[3] == 128:
+        return INSwapper(model_file=model_path, session=session)
+    if input_shape[2] == input_shape[3] and input_shape[2] >= 112 and input_shape[2] % 16 == 0:
+        return ArcFaceONNX(model_file=model_path, session=session)
+    return None
+
+
+def create_face_analyser(name: str) -> Any:
+    # assembled like FaceAnalysis does it, but from models whose sessions follow the thread budget
+    face_analyser = FaceAnalysis.__new__(FaceAnalysis)
+    face_analyser.model_dir = ensure_available('models', name, root='~/.insightface')
+    face_analyser.models = {}
+    for model_path in sorted(glob.glob(os.path.join(face_analyser.model_dir, '*.onnx'))):
+        model = load_onnx_model(model_path)
+        if model is not None and model.taskname not in face_analyser.models:
+            face_analyser.models[model.taskname] = model
+    face_analyser.det_model = face_analyser.models['detection']
+    return face_analyser
+
+
 def get_face_analyser() -> Any:
     global FACE_ANALYSER
 
     if FACE_ANALYSER is None:
-        # Get optimized session options and provider options
-        session_options = memory_optimizer.get_optimized_onnx_session_options()
-        provider_options = memory_optimizer.get_optimized_gpu_provider_options()
-        
-        # Create providers list with optimized options
-        providers = modules.globals.execution_providers.copy()
-        if 'CUDAExecutionProvider' in providers and provider_options:
-            providers = [('CUDAExecutionProvider', provider_options)] + [p for p in providers if p != 'CUDAExecutionProvider']
-        
-        FACE_ANALYSER = insightface.app.FaceAnalysis(
-            name='buffalo_l', 
-            providers=providers
-        )
+        FACE_ANALYSER = create_face_analyser('buffalo_l')
         FACE_ANALYSER.prepare(ctx_id=0, det_size=(640, 640))
     return FACE_ANALYSER
 
 
 def get_one_face(frame: Frame) -> Any:
-    face = get_face_analyser().get(frame)
+    face = get_many_faces(frame)
     try:
         return min(face, key=lambda x: x.bbox[0])
-    except ValueError:
+    except (ValueError, TypeError):
         return None
 
 
 def get_many_faces(frame: Frame) -> Any:
+    # reuse the detections of an earlier processor working on the same frame
+    frame_context = get_frame_context()
+    if frame_context is not None:
+        faces = frame_context.get_faces(frame)
+        if faces is not None:
+            return faces
     try:
-        return get_face_analyser().get(frame)
+        with measure('detection'):
+            faces = get_face_analyser().get(frame)
     except IndexError:
         return None
+    if frame_context is not None:
+        frame_context.set_faces(frame, faces)
+    return faces
 
 def has_valid_map() -> bool:
     for map in modules.globals.souce_target_map:
@@ -123,7 +165,7 @@ def get_unique_faces_from_target_video() -> Any:
 
         i = 0
         for temp_frame_path in tqdm(temp_frame_paths, desc="Extracting face embeddings from frames"):
-            temp_frame = cv2.imread(temp_frame_path)
+            temp_frame = read_frame(temp_frame_path)
             many_faces = get_many_faces(temp_frame)
 
             for face in many_faces:
@@ -174,7 +216,7 @@ def default_target_face():
 
         x_min, y_min, x_max, y_max = best_face['bbox']
 
-        target_frame = cv2.imread(best_frame['location'])
+        target_frame = read_frame(best_frame['location'])
         map['target'] = {
                         'cv2' : target_frame[int(y_min):int(y_max), int(x_min):int(x_max)],
                         'face' : best_face
@@ -190,7 +232,7 @@ def dump_faces(centroids: Any, frame_face_embeddings: list):
         Path(temp_directory_path + f"/{i}").mkdir(parents=True, exist_ok=True)
 
         for frame in tqdm(frame_face_embeddings, desc=f"Copying faces to temp/./{i}"):
-            temp_frame = cv2.imread(frame['location'])
+            temp_frame = read_frame(frame['location'])
 
             j = 0
             for face in frame['faces']:
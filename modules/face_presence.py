@@ -0,0 +1,44 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import modules.globals
+from modules.custom_types import Frame
+from modules.face_analyser import get_face_analyser
+from modules.frame_store import read_frame
+
+
+def detect_face_boxes(frame: Frame, size: Optional[int] = None) -> Any:
+    """
+    Run only the face detector and return its boxes, at the analyser input size unless given
+    """
+    bboxes, _ = get_face_analyser().det_model.detect(frame, input_size=(size, size) if size else None, max_num=0)
+    return bboxes if bboxes is not None else []
+
+
+def has_face(frame: Frame) -> bool:
+    # a heavily downscaled copy is enough to tell whether a face is there
+    return len(detect_face_boxes(frame, modules.globals.prescan_size)) > 0
+
+
+def build_face_presence_map(temp_frame_paths: List[str]) -> Dict[str, bool]:
+    """
+    Detect faces on every k-th frame and fill the frames in between from their neighbours
+    """
+    frame_total = len(temp_frame_paths)
+    if not frame_total:
+        return {}
+    stride = max(1, modules.globals.prescan_stride)
+    sample_indices = list(range(0, frame_total, stride))
+    if sample_indices[-1] != frame_total - 1:
+        sample_indices.append(frame_total - 1)
+    with ThreadPoolExecutor(max_workers=modules.globals.execution_threads) as executor:
+        sample_presence = dict(zip(sample_indices, executor.map(lambda index: has_face(read_frame(temp_frame_paths[index])), sample_indices)))
+
+    presence = {}
+    for start_index, end_index in zip(sample_indices, sample_indices[1:] + [frame_total]):
+        # keep the frames between two samples when either sample has a face
+        interval_presence = sample_presence[start_index] or sample_presence.get(end_index, False)
+        for index in range(start_index, end_index):
+            presence[temp_frame_paths[index]] = interval_presence
+        presence[temp_frame_paths[start_index]] = sample_presence[start_index]
+    return presence
@@ -0,0 +1,47 @@
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, List, Optional
+
+from modules.custom_types import Frame
+
+FRAME_CONTEXTS = threading.local()
+
+
+class FrameContext:
+    """
+    Face detections of one frame, shared by every processor of the chain instead of detecting again
+    """
+
+    def __init__(self) -> None:
+        self.shape: Optional[Any] = None
+        self.faces: Optional[List[Any]] = None
+
+    def get_faces(self, frame: Frame) -> Optional[List[Any]]:
+        # processors keep the face geometry, a frame of another size is not the frame these detections belong to
+        if self.faces is None or frame.shape[:2] != self.shape:
+            return None
+        return self.faces
+
+    def set_faces(self, frame: Frame, faces: List[Any]) -> None:
+        self.shape = frame.shape[:2]
+        self.faces = faces
+
+    def get_landmarks(self, frame: Frame) -> Optional[List[Any]]:
+        faces = self.get_faces(frame)
+        if not faces:
+            return None
+        return [face.kps for face in faces]
+
+
+def get_frame_context() -> Optional[FrameContext]:
+    return getattr(FRAME_CONTEXTS, 'current', None)
+
+
+@contextmanager
+def use_frame_context(frame_context: FrameContext) -> Iterator[FrameContext]:
+    previous_frame_context = get_frame_context()
+    FRAME_CONTEXTS.current = frame_context
+    try:
+        yield frame_context
+    finally:
+        FRAME_CONTEXTS.current = previous_frame_context
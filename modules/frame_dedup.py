@@ -0,0 +1,74 @@
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import cv2
+import numpy
+
+import modules.globals
+from modules.custom_types import Frame
+from modules.frame_store import read_frame, write_frame
+
+SIGNATURE_SIZE = 128
+# differences are averaged per block of signature pixels, about 60x34 pixels of a 1080p frame
+SIGNATURE_BLOCK_SIZE = 4
+
+
+def get_frame_signature(frame: Frame) -> Any:
+    return get_luma_signature(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+
+
+def get_luma_signature(luma: Any) -> Any:
+    return cv2.resize(luma, (SIGNATURE_SIZE, SIGNATURE_SIZE), interpolation=cv2.INTER_AREA).astype(numpy.int16)
+
+
+def get_signature_difference(signature: Any, reference_signature: Any) -> float:
+    # the largest block difference keeps a moving mouth visible, a mean over the whole frame averages it away
+    block_count = SIGNATURE_SIZE // SIGNATURE_BLOCK_SIZE
+    difference = numpy.abs(signature - reference_signature).reshape(block_count, SIGNATURE_BLOCK_SIZE, block_count, SIGNATURE_BLOCK_SIZE)
+    return float(difference.mean(axis=(1, 3)).max())
+
+
+class DuplicateFrameDetector:
+    """
+    Compare each frame with the first frame of the current run of near identical frames
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self.reference_signature = None
+
+    def is_duplicate_signature(self, signature: Any) -> bool:
+        # comparing against the run reference instead of the previous frame prevents slow drift
+        if self.reference_signature is not None and get_signature_difference(signature, self.reference_signature) <= self.threshold:
+            return True
+        self.reference_signature = signature
+        return False
+
+    def is_duplicate(self, frame: Frame) -> bool:
+        return self.is_duplicate_signature(get_frame_signature(frame))
+
+
+def find_duplicate_frames(temp_frame_paths: List[str]) -> Dict[str, str]:
+    """
+    Map every duplicate frame path to the path of the frame whose result it reuses
+    """
+    with ThreadPoolExecutor(max_workers=modules.globals.execution_threads) as executor:
+        signatures = executor.map(lambda temp_frame_path: get_frame_signature(read_frame(temp_frame_path)), temp_frame_paths)
+        detector = DuplicateFrameDetector(modules.globals.dedup_threshold)
+        duplicates = {}
+        reference_path = None
+        for temp_frame_path, signature in zip(temp_frame_paths, signatures):
+            if detector.is_duplicate_signature(signature):
+                duplicates[temp_frame_path] = reference_path
+            else:
+                reference_path = temp_frame_path
+    return duplicates
+
+
+def restore_duplicate_frames(duplicates: Dict[str, str]) -> None:
+    for duplicate_path, reference_path in duplicates.items():
+        if '#' in reference_path:
+            write_frame(duplicate_path, read_frame(reference_path))
+        else:
+            shutil.copyfile(reference_path, duplicate_path)
@@ -0,0 +1,249 @@
+import os
+import glob
+import struct
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Type
+
+import cv2
+import numpy
+
+import modules.globals
+from modules.custom_types import Frame
+from modules.metrics import measure
+
+TEMP_FRAME_PATTERN = '%06d'
+FRAME_CACHE_NAME = 'frames.raw'
+FRAME_CACHE_MAGIC = b'DLCRAW01'
+FRAME_CACHE_HEADER = struct.Struct('<8sIIII')
+FRAME_CACHE_HEADER_SIZE = 4096
+FRAME_CACHES: Dict[str, 'FrameCache'] = {}
+FRAME_CACHES_LOCK = threading.Lock()
+
+
+class FrameStore:
+    """
+    Storage backend for temp frames: how they are extracted, read and written
+    """
+
+    name = ''
+    extension = ''
+
+    def get_extract_args(self) -> Optional[List[str]]:
+        """ffmpeg output args to extract frames directly, None if frames must be written through a pipe"""
+        return None
+
+    def get_encode_args(self, temp_directory_path: str, fps: float) -> Optional[List[str]]:
+        """ffmpeg input args to encode the stored frames directly, None if frames must be read through a pipe"""
+        if self.get_extract_args() is None:
+            return None
+        return ['-r', str(fps), '-i', os.path.join(temp_directory_path, TEMP_FRAME_PATTERN + self.extension)]
+
+    def write_all(self, temp_directory_path: str, frames: Iterable[Frame], width: int, height: int) -> None:
+        for frame_number, frame in enumerate(frames, start=1):
+            self.write(os.path.join(temp_directory_path, get_frame_name(frame_number, self)), frame)
+
+    def list_frames(self, temp_directory_path: str) -> List[str]:
+        return sorted(glob.glob(os.path.join(glob.escape(temp_directory_path), '*' + self.extension)))
+
+    def read(self, path: str) -> Frame:
+        return cv2.imread(path)
+
+    def write(self, path: str, frame: Frame) -> None:
+        # a frame killed half way must not replace the one on disk, the journal only lists whole frames
+        # spilled frames are symlinks out of the ram directory, the frame is replaced where the link points
+        path = os.path.realpath(path)
+        partial_path = get_partial_path(path)
+        try:
+            self.write_file(partial_path, frame)
+            os.replace(partial_path, path)
+        finally:
+            if os.path.isfile(partial_path):
+                os.remove(partial_path)
+
+    def write_file(self, path: str, frame: Frame) -> None:
+        if not cv2.imwrite(path, frame, self.get_write_params()):
+            raise IOError(f'could not write {path}')
+
+    def get_write_params(self) -> List[int]:
+        return []
+
+
+class PngFrameStore(FrameStore):
+    name = 'png'
+    extension = '.png'
+
+    def get_extract_args(self) -> Optional[List[str]]:
+        return ['-pix_fmt', 'rgb24', '-compression_level', str(modules.globals.png_compression)]
+
+    def get_write_params(self) -> List[int]:
+        return [cv2.IMWRITE_PNG_COMPRESSION, modules.globals.png_compression]
+
+
+class BmpFrameStore(FrameStore):
+    name = 'bmp'
+    extension = '.bmp'
+
+    def get_extract_args(self) -> Optional[List[str]]:
+        return ['-pix_fmt', 'bgr24']
+
+
+class JpegFrameStore(FrameStore):
+    name = 'jpg'
+    extension = '.jpg'
+
+    def get_extract_args(self) -> Optional[List[str]]:
+        # map the 1-100 jpeg quality onto the 31-1 mjpeg qscale
+        qscale = max(1, min(31, round(31 - modules.globals.jpeg_quality * 0.3)))
+        return ['-pix_fmt', 'yuvj444p', '-q:v', str(qscale)]
+
+    def get_write_params(self) -> List[int]:
+        return [cv2.IMWRITE_JPEG_QUALITY, modules.globals.jpeg_quality, cv2.IMWRITE_JPEG_SAMPLING_FACTOR, cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444]
+
+
+class NpyFrameStore(FrameStore):
+    name = 'npy'
+    extension = '.npy'
+
+    def read(self, path: str) -> Frame:
+        return numpy.load(path)
+
+    def write_file(self, path: str, frame: Frame) -> None:
+        numpy.save(path, frame)
+
+
+class FrameCache:
+    """
+    Single memory-mapped file holding every frame of a video at a fixed stride
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            magic, self.width, self.height, self.channels, self.frame_count = FRAME_CACHE_HEADER.unpack(file.read(FRAME_CACHE_HEADER.size))
+        if magic != FRAME_CACHE_MAGIC:
+            raise ValueError(f'{path} is not a frame cache')
+        shape = (self.frame_count, self.height, self.width, self.channels)
+        if self.frame_count:
+            self.frames = numpy.memmap(path, dtype=numpy.uint8, mode='r+', offset=FRAME_CACHE_HEADER_SIZE, shape=shape)
+        else:
+            self.frames = numpy.zeros(shape, dtype=numpy.uint8)
+
+    def flush(self) -> None:
+        if isinstance(self.frames, numpy.memmap):
+            self.frames.flush()
+
+    def close(self) -> None:
+        self.flush()
+        # dropping the last reference to the memmap unmaps the file
+        del self.frames
+
+
+def get_frame_cache(path: str) -> FrameCache:
+    with FRAME_CACHES_LOCK:
+        if path not in FRAME_CACHES:
+            FRAME_CACHES[path] = FrameCache(path)
+        return FRAME_CACHES[path]
+
+
+def close_frame_caches() -> None:
+    with FRAME_CACHES_LOCK:
+        for frame_cache in FRAME_CACHES.values():
+            frame_cache.close()
+        FRAME_CACHES.clear()
+
+
+class RawFrameStore(FrameStore):
+    """
+    Frames live in one memory-mapped cache file and are addressed as <cache>#<frame number>
+    """
+
+    name = 'raw'
+    extension = '.raw'
+
+    def split_path(self, path: str) -> Any:
+        cache_path, frame_number = path.rsplit('#', 1)
+        return get_frame_cache(cache_path), int(frame_number) - 1
+
+    def read(self, path: str) -> Frame:
+        frame_cache, index = self.split_path(path)
+        return frame_cache.frames[index]
+
+    def write(self, path: str, frame: Frame) -> None:
+        frame_cache, index = self.split_path(path)
+        view = frame_cache.frames[index]
+        # indexing the memmap makes a new view object each time, only the memory tells if the frame is the slot itself
+        if not numpy.shares_memory(frame, view):
+            view[...] = frame
+
+    def write_all(self, temp_directory_path: str, frames: Iterable[Frame], width: int, height: int) -> None:
+        cache_path = os.path.join(temp_directory_path, FRAME_CACHE_NAME)
+        with FRAME_CACHES_LOCK:
+            frame_cache = FRAME_CACHES.pop(cache_path, None)
+        if frame_cache:
+            frame_cache.close()
+        frame_count = 0
+        with open(cache_path, 'wb') as file:
+            file.write(bytes(FRAME_CACHE_HEADER_SIZE))
+            for frame in frames:
+                file.write(numpy.ascontiguousarray(frame).tobytes())
+                frame_count += 1
+            # the frame count is only known once the decoder is drained
+            file.seek(0)
+            file.write(FRAME_CACHE_HEADER.pack(FRAME_CACHE_MAGIC, width, height, 3, frame_count))
+
+    def list_frames(self, temp_directory_path: str) -> List[str]:
+        cache_path = os.path.join(temp_directory_path, FRAME_CACHE_NAME)
+        if not os.path.isfile(cache_path):
+            return []
+        frame_cache = get_frame_cache(cache_path)
+        return [f'{cache_path}#{frame_number}' for frame_number in range(1, frame_cache.frame_count + 1)]
+
+    def get_encode_args(self, temp_directory_path: str, fps: float) -> Optional[List[str]]:
+        cache_path = os.path.join(temp_directory_path, FRAME_CACHE_NAME)
+        frame_cache = get_frame_cache(cache_path)
+        frame_cache.flush()
+        return ['-skip_initial_bytes', str(FRAME_CACHE_HEADER_SIZE), '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{frame_cache.width}x{frame_cache.height}', '-r', str(fps), '-i', cache_path]
+
+
+FRAME_STORES: Dict[str, Type[FrameStore]] = {
+    'png': PngFrameStore,
+    'bmp': BmpFrameStore,
+    'jpg': JpegFrameStore,
+    'npy': NpyFrameStore,
+    'raw': RawFrameStore,
+}
+
+
+def get_frame_store(name: Optional[str] = None) -> FrameStore:
+    return FRAME_STORES[name or modules.globals.temp_frame_format]()
+
+
+def get_frame_store_for_path(path: str) -> FrameStore:
+    if path.rsplit('#', 1)[0].endswith(RawFrameStore.extension):
+        return RawFrameStore()
+    _, extension = os.path.splitext(path)
+    for frame_store in FRAME_STORES.values():
+        if frame_store.extension == extension.lower():
+            return frame_store()
+    return get_frame_store()
+
+
+def read_frame(path: str) -> Frame:
+    with measure('decode'):
+        return get_frame_store_for_path(path).read(path)
+
+
+def write_frame(path: str, frame: Frame) -> None:
+    with measure('frame_write'):
+        get_frame_store_for_path(path).write(path, frame)
+
+
+def get_partial_path(path: str) -> str:
+    # hidden and with the same extension, so the encoder is picked the same and the frame globs skip it
+    directory_path, file_name = os.path.split(path)
+    return os.path.join(directory_path, '.' + file_name)
+
+
+def get_frame_name(frame_number: int, frame_store: Any = None) -> str:
+    frame_store = frame_store or get_frame_store()
+    return (TEMP_FRAME_PATTERN % frame_number) + frame_store.extension
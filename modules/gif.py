@@ -0,0 +1,60 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from typing import Any, Dict, List, Optional, Tuple
+
+import cv2
+import numpy
+from PIL import Image, ImageSequence
+
+import modules.globals
+from modules.custom_types import Frame
+
+DEFAULT_FRAME_DURATION = 100
+
+
+def read_gif(gif_path: str) -> Tuple[List[Frame], List[int], Optional[int]]:
+    """
+    Decode every gif frame into memory together with its duration in milliseconds and the loop count, None if it plays once
+    """
+    frames = []
+    durations = []
+    with Image.open(gif_path) as gif:
+        # without a netscape loop extension the gif plays once, a loop of 0 would repeat it forever
+        loop = gif.info.get('loop')
+        for gif_frame in ImageSequence.Iterator(gif):
+            durations.append(gif_frame.info.get('duration', DEFAULT_FRAME_DURATION))
+            # converting composes the frame over the previous ones, so every frame is complete
+            frames.append(cv2.cvtColor(numpy.array(gif_frame.convert('RGB')), cv2.COLOR_RGB2BGR))
+    return frames, durations, loop
+
+
+def get_gif_frame_count(gif_path: str) -> int:
+    # pillow counts the frames from the headers, nothing is decoded
+    with Image.open(gif_path) as gif:
+        return getattr(gif, 'n_frames', 1)
+
+
+def write_gif(output_path: str, frames: List[Frame], durations: List[int], loop: Optional[int]) -> None:
+    # an adaptive palette per frame, pillow only stores what changed between frames when optimizing
+    images = [Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)).quantize(colors=256) for frame in frames]
+    save_args: Dict[str, Any] = {'save_all': True, 'append_images': images[1:], 'duration': durations, 'optimize': True, 'disposal': 1}
+    if loop is not None:
+        save_args['loop'] = loop
+    images[0].save(output_path, **save_args)
+
+
+def process_gif(source_path: str, target_path: str, output_path: str, frame_processors: List[ModuleType]) -> bool:
+    from modules.processors.frame.core import create_progress_bar, get_source_face, run_frame_processors
+
+    frames, durations, loop = read_gif(target_path)
+    if not frames:
+        return False
+    source_face = get_source_face(source_path)
+
+    processed_frames = []
+    with create_progress_bar(len(frames), stage='gif') as progress, ThreadPoolExecutor(max_workers=modules.globals.execution_threads) as executor:
+        for processed_frame in executor.map(lambda temp_frame: run_frame_processors(frame_processors, source_face, temp_frame), frames):
+            processed_frames.append(processed_frame)
+            progress.update(1)
+    write_gif(output_path, processed_frames, durations, loop)
+    return True
@@ -19,17 +19,52 @@ frame_processors: List[str] = []
 keep_fps = True
 keep_audio = True
 keep_frames = False
+checkpoint = True
 many_faces = False
+face_prescan = False
+prescan_stride = 1
+prescan_size = 320
+frame_dedup = False
+dedup_threshold = 0.5
 map_faces = False
 color_correction = False  # New global variable for color correction toggle
 nsfw_filter = False
 video_encoder = None
 video_quality = None
+video_pipeline = "frames"
+draft = False
+draft_height = 360
+draft_stride = 4
+draft_fill = "repeat"
+progressive_output = False
+preview_rendition = False
+preview_height = 480
+preview_bitrate = "600k"
+video_segments = 1
+video_ranges: List[List[float]] = []
+temp_frame_format = "png"
+png_compression = 1
+jpeg_quality = 95
+temp_store = "disk"
+temp_ram_path = "/dev/shm"
+temp_ram_budget = 4.0
 live_mirror = False
 live_resizable = False
 max_memory = None
 execution_providers: List[str] = []
 execution_threads = None
+execution_mode = "thread"
+autotune_threads = False
+read_threads = 2
+write_threads = 2
+stage_threads: Dict[str, int] = {}
+frame_queue_size = 16
+thread_budget = "auto"
+cpu_affinity = False
+ort_spinning = "auto"
+metrics_output = None
+trace_path = None
+estimate = False
 headless = None
 web_mode = False
 log_level = "error"
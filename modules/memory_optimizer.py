@@ -6,6 +6,7 @@ import torch
 import tensorflow as tf
 import onnxruntime as ort
 import modules.globals
+from modules.thread_budget import apply_session_options
 
 logger = logging.getLogger(__name__)
 
@@ -85,10 +86,13 @@ class MemoryOptimizer:
         # Enable all optimizations
         session_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
         
-        # Set thread counts based on system capabilities
-        cpu_count = psutil.cpu_count(logical=False)
-        session_options.intra_op_num_threads = min(cpu_count, 8)
-        session_options.inter_op_num_threads = min(cpu_count // 2, 4)
+        # Set thread counts from the core budget shared with the frame workers
+        if modules.globals.thread_budget == 'auto':
+            apply_session_options(session_options)
+        else:
+            cpu_count = psutil.cpu_count(logical=False)
+            session_options.intra_op_num_threads = min(cpu_count, 8)
+            session_options.inter_op_num_threads = min(cpu_count // 2, 4)
         
         # Enable memory pattern optimization
         session_options.enable_mem_pattern = True
@@ -134,6 +138,24 @@ class MemoryOptimizer:
         
         return cuda_options
     
+    def create_onnx_session(self, model_path: str) -> ort.InferenceSession:
+        """Create an ONNX Runtime session with the optimized session and provider options"""
+        session_options = self.get_optimized_onnx_session_options()
+        provider_options = self.get_optimized_gpu_provider_options()
+        
+        # Create providers list with optimized options
+        providers = modules.globals.execution_providers.copy()
+        if 'CUDAExecutionProvider' in providers and provider_options:
+            providers = [('CUDAExecutionProvider', provider_options)] + [p for p in providers if p != 'CUDAExecutionProvider']
+        
+        session = ort.InferenceSession(model_path, sess_options=session_options, providers=providers)
+        
+        # Make sure the thread budget reached the session and was not replaced by a default
+        applied_threads = session.get_session_options().intra_op_num_threads
+        if applied_threads != session_options.intra_op_num_threads:
+            logger.warning(f"Session for {os.path.basename(model_path)} uses {applied_threads} intra op threads instead of {session_options.intra_op_num_threads}")
+        return session
+    
     def optimize_torch_memory(self) -> None:
         """Optimize PyTorch memory usage"""
         if torch.cuda.is_available():
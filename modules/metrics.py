@@ -0,0 +1,194 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import psutil
+
+from modules.tracer import record_seconds
+
+# latency buckets in seconds, from a cheap opencv call up to a slow enhancer pass on cpu
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SESSION_SECONDS = threading.local()
+
+
+class Histogram:
+    """
+    Latency histogram per stage label with cumulative buckets as prometheus expects them
+    """
+
+    def __init__(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series: Dict[str, List[Any]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label: str, value: float) -> None:
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                # bucket counts, count, sum and max
+                series = self.series[label] = [[0] * len(self.buckets), 0, 0.0, 0.0]
+            for index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    series[0][index] += 1
+                    break
+            series[1] += 1
+            series[2] += value
+            series[3] = max(series[3], value)
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label, (bucket_counts, count, total, _) in sorted(self.series.items()):
+                cumulative = 0
+                for bucket, bucket_count in zip(self.buckets, bucket_counts):
+                    cumulative += bucket_count
+                    lines.append(f'{self.name}_bucket{{stage="{label}",le="{bucket}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{stage="{label}",le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{stage="{label}"}} {total}')
+                lines.append(f'{self.name}_count{{stage="{label}"}} {count}')
+        return lines
+
+    def summarize(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {label: {'count': count, 'total_seconds': round(total, 6), 'mean_ms': round(total * 1000 / count, 3) if count else 0.0, 'max_ms': round(maximum * 1000, 3)} for label, (_, count, total, maximum) in sorted(self.series.items())}
+
+
+class Gauge:
+    """
+    Current value per label, for queue depths, busy workers and memory
+    """
+
+    def __init__(self, name: str, help_text: str, label_name: str):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self.values: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def set(self, label: str, value: float) -> None:
+        with self.lock:
+            self.values[label] = value
+
+    def add(self, label: str, value: float) -> None:
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} gauge']
+        with self.lock:
+            for label, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{{{self.label_name}="{label}"}} {value}')
+        return lines
+
+    def summarize(self) -> Dict[str, float]:
+        with self.lock:
+            return dict(sorted(self.values.items()))
+
+
+STAGE_SECONDS = Histogram('dlc_stage_seconds', 'Time spent per frame engine stage, the count is the number of calls')
+QUEUE_DEPTH = Gauge('dlc_queue_depth', 'Items waiting in front of a pipeline stage', 'stage')
+ACTIVE_WORKERS = Gauge('dlc_active_workers', 'Workers busy in a pipeline stage', 'stage')
+MEMORY_BYTES = Gauge('dlc_memory_bytes', 'Resident memory of the process and memory allocated on the gpu', 'kind')
+COLLECTORS: List[Callable[[], None]] = []
+COLLECTORS_LOCK = threading.Lock()
+
+
+def observe(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(stage, seconds)
+    # every measured stage shows up on the trace timeline as well
+    record_seconds(stage, 'stage', seconds)
+
+
+@contextmanager
+def measure(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - started)
+
+
+class MeasuredSession:
+    """
+    Inference session wrapper timing every run, the duration of the last run stays readable per thread
+    """
+
+    def __init__(self, session: Any, stage: str):
+        self.session = session
+        self.stage = stage
+
+    def run(self, *args: Any, **kwargs: Any) -> Any:
+        started = time.perf_counter()
+        try:
+            return self.session.run(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            SESSION_SECONDS.value = seconds
+            observe(self.stage, seconds)
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.session, name)
+
+
+def get_last_session_seconds() -> float:
+    return getattr(SESSION_SECONDS, 'value', 0.0)
+
+
+def add_collector(collector: Callable[[], None]) -> None:
+    with COLLECTORS_LOCK:
+        COLLECTORS.append(collector)
+
+
+def remove_collector(collector: Callable[[], None]) -> None:
+    with COLLECTORS_LOCK:
+        if collector in COLLECTORS:
+            COLLECTORS.remove(collector)
+
+
+def collect_memory() -> None:
+    MEMORY_BYTES.set('rss', psutil.Process(os.getpid()).memory_info().rss)
+    # only look at the gpu when torch is loaded anyway, importing it for a gauge is not worth it
+    torch = sys.modules.get('torch')
+    if torch is not None and torch.cuda.is_available():
+        MEMORY_BYTES.set('vram', torch.cuda.memory_allocated())
+
+
+def collect() -> None:
+    # gauges are sampled when they are read, so the frame engine does not pay for them per frame
+    with COLLECTORS_LOCK:
+        collectors = [collect_memory] + COLLECTORS
+    for collector in collectors:
+        collector()
+
+
+def render_prometheus() -> str:
+    collect()
+    lines = []
+    for metric in (STAGE_SECONDS, QUEUE_DEPTH, ACTIVE_WORKERS, MEMORY_BYTES):
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def get_summary() -> Dict[str, Any]:
+    collect()
+    return {
+        'stages': STAGE_SECONDS.summarize(),
+        'queue_depth': QUEUE_DEPTH.summarize(),
+        'active_workers': ACTIVE_WORKERS.summarize(),
+        'memory_bytes': MEMORY_BYTES.summarize()
+    }
+
+
+def dump_summary(output_path: Optional[str] = None) -> None:
+    summary = json.dumps(get_summary(), indent=2)
+    if output_path is None:
+        print(summary)
+        return
+    with open(output_path, 'w') as summary_file:
+        summary_file.write(summary)
@@ -0,0 +1,172 @@
+import os
+import json
+import shutil
+import threading
+import subprocess
+from typing import Any, Dict, List, Optional
+
+import cv2
+
+from modules.tracer import span
+
+PROBE_CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'deep-live-cam', 'probe.json')
+PROBE_CACHE_LIMIT = 256
+PROBE_CACHE: Dict[str, Dict[str, Any]] = {}
+PROBE_CACHE_LOADED = False
+THUMBNAIL_CACHE: Dict[str, bytes] = {}
+PROBE_LOCK = threading.RLock()
+
+
+def get_probe_key(path: str) -> str:
+    stat = os.stat(path)
+    return f'{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}'
+
+
+def load_probe_cache() -> None:
+    global PROBE_CACHE_LOADED
+
+    if PROBE_CACHE_LOADED:
+        return
+    PROBE_CACHE_LOADED = True
+    try:
+        with open(PROBE_CACHE_PATH) as probe_cache:
+            PROBE_CACHE.update(json.load(probe_cache))
+    except (OSError, ValueError):
+        pass
+
+
+def save_probe_cache() -> None:
+    # keep the most recently probed files only
+    for key in list(PROBE_CACHE)[:-PROBE_CACHE_LIMIT]:
+        del PROBE_CACHE[key]
+    try:
+        os.makedirs(os.path.dirname(PROBE_CACHE_PATH), exist_ok=True)
+        with open(PROBE_CACHE_PATH + '.tmp', 'w') as probe_cache:
+            json.dump(PROBE_CACHE, probe_cache)
+        os.replace(PROBE_CACHE_PATH + '.tmp', PROBE_CACHE_PATH)
+    except OSError:
+        pass
+
+
+def parse_frame_rate(frame_rate: str) -> float:
+    try:
+        numerator, denominator = map(int, frame_rate.split('/'))
+        return numerator / denominator
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def get_stream_rotation(video_stream: Dict[str, Any]) -> int:
+    # newer ffmpeg writes a display matrix, older files carry a rotate tag
+    for side_data in video_stream.get('side_data_list', []):
+        if 'rotation' in side_data:
+            return int(float(side_data['rotation'])) % 360
+    try:
+        return int(video_stream.get('tags', {}).get('rotate', 0)) % 360
+    except ValueError:
+        return 0
+
+
+def run_ffprobe(path: str) -> Optional[Dict[str, Any]]:
+    if not shutil.which('ffprobe'):
+        return None
+    command = ['ffprobe', '-v', 'error', '-show_streams', '-show_format', '-of', 'json', path]
+    try:
+        with span('ffprobe', 'ffmpeg'):
+            output = json.loads(subprocess.check_output(command).decode())
+    except (subprocess.CalledProcessError, ValueError):
+        return None
+    streams = output.get('streams', [])
+    video_stream = next((stream for stream in streams if stream.get('codec_type') == 'video'), None)
+    if not video_stream:
+        return None
+    fps = parse_frame_rate(video_stream.get('r_frame_rate', '')) or parse_frame_rate(video_stream.get('avg_frame_rate', '')) or 30.0
+    duration = float(video_stream.get('duration') or output.get('format', {}).get('duration') or 0.0)
+    frame_count = int(video_stream.get('nb_frames') or round(duration * fps))
+    return {
+        'fps': fps,
+        'frame_count': frame_count,
+        'width': int(video_stream.get('width', 0)),
+        'height': int(video_stream.get('height', 0)),
+        'rotation': get_stream_rotation(video_stream),
+        'duration': duration,
+        'pix_fmt': video_stream.get('pix_fmt'),
+        'codec': video_stream.get('codec_name'),
+        'has_audio': any(stream.get('codec_type') == 'audio' for stream in streams),
+    }
+
+
+def run_capture_probe(path: str) -> Dict[str, Any]:
+    capture = cv2.VideoCapture(path)
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+    frame_count = int(capture.get(cv2.CAP_PROP_FRAME_COUNT))
+    probe = {
+        'fps': fps,
+        'frame_count': frame_count,
+        'width': int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        'height': int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        'rotation': int(capture.get(cv2.CAP_PROP_ORIENTATION_META)) % 360,
+        'duration': frame_count / fps,
+        'pix_fmt': None,
+        'codec': None,
+        'has_audio': False,
+    }
+    capture.release()
+    return probe
+
+
+def probe_media(path: str) -> Dict[str, Any]:
+    """
+    Return fps, frame count, coded resolution, rotation, duration, pixel format, codec and audio presence of a media file
+    """
+    key = get_probe_key(path)
+    with PROBE_LOCK:
+        load_probe_cache()
+        # entries cached before the rotation was probed are probed again
+        if key in PROBE_CACHE and 'rotation' in PROBE_CACHE[key]:
+            return PROBE_CACHE[key]
+    probe = run_ffprobe(path) or run_capture_probe(path)
+    with PROBE_LOCK:
+        if 'rotation' not in PROBE_CACHE.get(key, {}):
+            PROBE_CACHE[key] = probe
+        save_probe_cache()
+        return PROBE_CACHE[key]
+
+
+def probe_keyframes(path: str) -> List[float]:
+    """
+    Return the presentation times of the video keyframes, probed once per file
+    """
+    probe = probe_media(path)
+    if 'keyframes' not in probe:
+        command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', path]
+        keyframes = []
+        with span('ffprobe keyframes', 'ffmpeg'):
+            output = subprocess.check_output(command).decode()
+        for line in output.strip().splitlines():
+            pts_time, _, flags = line.partition(',')
+            if 'K' in flags and pts_time not in ('', 'N/A'):
+                keyframes.append(float(pts_time))
+        with PROBE_LOCK:
+            probe['keyframes'] = sorted(keyframes)
+            save_probe_cache()
+    return probe['keyframes']
+
+
+def probe_thumbnail(path: str) -> Optional[bytes]:
+    """
+    Return the first video frame as jpeg bytes, decoded once per file
+    """
+    key = get_probe_key(path)
+    with PROBE_LOCK:
+        if key in THUMBNAIL_CACHE:
+            return THUMBNAIL_CACHE[key]
+    capture = cv2.VideoCapture(path)
+    has_frame, frame = capture.read()
+    capture.release()
+    if not has_frame:
+        return None
+    _, thumbnail = cv2.imencode('.jpg', frame)
+    with PROBE_LOCK:
+        THUMBNAIL_CACHE[key] = thumbnail.tobytes()
+        return THUMBNAIL_CACHE[key]
@@ -1,12 +1,32 @@
+import os
 import sys
+import time
 import importlib
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from types import ModuleType
-from typing import Any, List, Callable
+from typing import Any, List, Callable, Deque, Iterable, Iterator, Optional, Tuple
+import cv2
+import numpy
 from tqdm import tqdm
 
 import modules
 import modules.globals                   
+from modules.capturer import get_video_frame_total
+from modules.checkpoint import has_checkpoint, get_completed_frames, mark_frame_completed
+from modules.custom_types import Frame
+from modules.events import ProgressEvent, publish, get_job_id
+from modules.tracer import span
+from modules.face_analyser import get_one_face, get_many_faces
+from modules.frame_context import FrameContext, use_frame_context
+from modules.face_presence import has_face
+from modules.frame_store import read_frame, write_frame
+from modules.frame_dedup import DuplicateFrameDetector, get_frame_signature, get_luma_signature
+from modules.yuv import get_yuv_planes, get_face_rois, read_yuv_roi, write_yuv_roi
+from modules.autotuner import WorkerLimit, create_thread_autotuner, get_autotune_maximum
+from modules.processors.frame.pipeline import FramePipeline
+from modules.processors.frame.process_pool import FrameProcessPool
+from modules.utilities import detect_resolution, open_frame_reader, open_frame_writer, close_frame_writer, read_raw_frames, get_draft_encoder_args
 
 FRAME_PROCESSORS_MODULES: List[ModuleType] = []
 FRAME_PROCESSORS_INTERFACE = [
@@ -56,82 +76,354 @@ def set_frame_processors_modules_from_ui(frame_processors: List[str]) -> None:
                 pass
 
 def multi_process_frame(source_path: str, temp_frame_paths: List[str], process_frames: Callable[[str, List[str], Any], None], progress: Any = None) -> None:
-    with ThreadPoolExecutor(max_workers=modules.globals.execution_threads) as executor:
-        futures = []
-        for path in temp_frame_paths:
-            future = executor.submit(process_frames, source_path, [path], progress)
-            futures.append(future)
-        for future in futures:
-            future.result()
+    pipeline = FramePipeline([('process', lambda temp_frame_path: process_frames(source_path, [temp_frame_path], progress), modules.globals.execution_threads)], modules.globals.frame_queue_size)
+    pipeline.run(temp_frame_paths)
 
 
-def process_video(source_path: str, frame_paths: list[str], process_frames: Callable[[str, List[str], Any], None]) -> None:
+def staged_process_frame(source_path: str, temp_frame_paths: List[str], frame_processors: List[ModuleType], progress: Any = None, on_frame_done: Optional[Callable[[str], None]] = None) -> None:
+    """
+    Read every frame once, run it through one stage per processor and write it once, each stage with its own workers
+    """
+    source_face = get_source_face(source_path)
+
+    def read_stage(temp_frame_path: str) -> Tuple[str, Frame, FrameContext]:
+        return temp_frame_path, read_frame(temp_frame_path), FrameContext()
+
+    def detect_stage(item: Tuple[str, Frame, FrameContext]) -> Tuple[str, Frame, FrameContext]:
+        temp_frame_path, temp_frame, frame_context = item
+        # detect once up front, the processors read the faces from the frame context
+        with use_frame_context(frame_context):
+            get_many_faces(temp_frame)
+        return item
+
+    def create_process_stage(frame_processor: ModuleType) -> Callable[[Tuple[str, Frame, FrameContext]], Tuple[str, Frame, FrameContext]]:
+        def process_stage(item: Tuple[str, Frame, FrameContext]) -> Tuple[str, Frame, FrameContext]:
+            temp_frame_path, temp_frame, frame_context = item
+            with use_frame_context(frame_context), span(frame_processor.NAME, 'processor'):
+                try:
+                    temp_frame = frame_processor.process_frame(source_face, temp_frame)
+                except Exception as exception:
+                    print(exception)
+            return temp_frame_path, temp_frame, frame_context
+        return process_stage
+
+    def write_stage(item: Tuple[str, Frame, FrameContext]) -> None:
+        temp_frame_path, temp_frame, _ = item
+        write_frame(temp_frame_path, temp_frame)
+        if on_frame_done:
+            on_frame_done(temp_frame_path)
+        if autotuner:
+            autotuner.record_frame()
+        if progress:
+            progress.update(1)
+
+    compute_stages = [('detect', detect_stage)] + [(get_frame_processor_name(frame_processor), create_process_stage(frame_processor)) for frame_processor in frame_processors]
+    autotuner = None
+    # stages given their own worker count keep it, the tuner only moves the others
+    tuned_stages = [(name, stage) for name, stage in compute_stages if name not in modules.globals.stage_threads]
+    if modules.globals.autotune_threads and tuned_stages:
+        # start the most workers the tuner may ask for and let the worker limits decide how many run
+        worker_limits = [WorkerLimit(modules.globals.execution_threads) for _ in tuned_stages]
+        autotuner = create_thread_autotuner([get_frame_processor_name(frame_processor) for frame_processor in frame_processors], worker_limits)
+        limited_stages = {name: limit_stage(stage, worker_limit) for (name, stage), worker_limit in zip(tuned_stages, worker_limits)}
+        compute_stages = [(name, limited_stages.get(name, stage)) for name, stage in compute_stages]
+    stages = [('read', read_stage, modules.globals.read_threads)]
+    stages.extend((name, stage, get_stage_workers(name)) for name, stage in compute_stages)
+    stages.append(('write', write_stage, modules.globals.write_threads))
+    pipeline = FramePipeline(stages, modules.globals.frame_queue_size)
+    pipeline.run(temp_frame_paths)
+
+
+def get_stage_workers(stage: str) -> int:
+    if stage in modules.globals.stage_threads:
+        return modules.globals.stage_threads[stage]
+    # the autotuner starts as many workers as it may ever ask for and limits how many run
+    return get_autotune_maximum() if modules.globals.autotune_threads else modules.globals.execution_threads
+
+
+def get_staged_inference_workers(frame_processors: List[ModuleType]) -> int:
+    """
+    Workers that may run inference at the same time in the staged pipeline, the detect stage and every processor stage
+    """
+    return sum(get_stage_workers(stage) for stage in ['detect'] + [get_frame_processor_name(frame_processor) for frame_processor in frame_processors])
+
+
+def limit_stage(stage: Callable[[Any], Any], worker_limit: WorkerLimit) -> Callable[[Any], Any]:
+    def limited_stage(item: Any) -> Any:
+        with worker_limit.acquire():
+            return stage(item)
+    return limited_stage
+
+
+def create_progress_bar(total: int, initial: int = 0, stage: str = 'frames') -> Any:
     progress_bar_format = '{l_bar}{bar}| {n_fmt}/{total_fmt} [{elapsed}<{remaining}, {rate_fmt}{postfix}]'
-    total = len(frame_paths)
-    
-    # Use a simpler approach with a wrapper that tracks progress
-    import time
-    last_update_time = 0
-    
-    def update_web_progress(pbar):
-        nonlocal last_update_time
-        current_time = time.time()
-        
-        # Only update every 0.5 seconds to avoid spamming
-        if current_time - last_update_time < 0.5:
-            return
-        last_update_time = current_time
-        
-        try:
-            from modules.core import update_status
-            
-            # Calculate percentage
-            percentage = int((pbar.n / pbar.total) * 100) if pbar.total > 0 else 0
-            
-            # Calculate timing information more accurately
-            current_time = time.time()
-            elapsed_time = current_time - pbar.start_t
-            elapsed = pbar.format_interval(elapsed_time)
-            
-            # Calculate rate (time per frame)
-            if pbar.n > 0 and elapsed_time > 0:
-                rate_value = elapsed_time / pbar.n
-                rate = f"{rate_value:.2f}s/frame"
-            else:
-                rate = "0.00s/frame"
-            
-            # Calculate remaining time
-            if pbar.n > 0 and elapsed_time > 0:
-                remaining_frames = pbar.total - pbar.n
-                time_per_frame = elapsed_time / pbar.n
-                eta_seconds = remaining_frames * time_per_frame
-                remaining = pbar.format_interval(eta_seconds)
-            else:
-                remaining = '00:00'
-            
-            # Create progress message that matches the expected format
-            postfix_str = f"execution_providers={modules.globals.execution_providers}, execution_threads={modules.globals.execution_threads}, max_memory={modules.globals.max_memory}"
-            progress_msg = f"{percentage:3d}%|{'█' * (percentage // 4)}{'▊' if percentage % 4 >= 2 else ''}{'▏' if percentage % 4 == 1 else ''}{'▎' if percentage % 4 == 3 else ''}{' ' * (25 - percentage // 4)}| {pbar.n}/{pbar.total} [{elapsed}<{remaining}, {rate}, {postfix_str}]"
-            
-            # Send to update_status for web interface parsing
-            update_status(progress_msg, 'VIDEO-PROGRESS')
-            
-        except Exception as e:
-            # Fallback to simple progress if detailed formatting fails
-            try:
-                from modules.core import update_status
-                percentage = int((pbar.n / pbar.total) * 100) if pbar.total > 0 else 0
-                update_status(f"Processing video frames: {pbar.n}/{pbar.total} ({percentage}%)", 'VIDEO-PROGRESS')
-            except:
-                pass
-    
-    # Custom progress class that calls our update function
-    class WebProgressBar(tqdm):
+    job_id = get_job_id()
+
+    class EventProgressBar(tqdm):
+        reused = 0
+        last_publish_time = 0.0
+
         def update(self, n=1):
             result = super().update(n)
-            update_web_progress(self)
+            # listeners get the raw counts, at most twice a second and once more for the last frame
+            current_time = time.time()
+            if current_time - self.last_publish_time >= 0.5 or self.n >= self.total:
+                self.last_publish_time = current_time
+                publish(ProgressEvent(job_id, stage, self.n, self.total, current_time - self.start_t, self.reused))
             return result
-    
-    with WebProgressBar(total=total, desc='Processing', unit='frame', dynamic_ncols=True, bar_format=progress_bar_format) as progress:
-        progress.set_postfix({'execution_providers': modules.globals.execution_providers, 'execution_threads': modules.globals.execution_threads, 'max_memory': modules.globals.max_memory})
-        multi_process_frame(source_path, frame_paths, process_frames, progress)
+
+    progress = EventProgressBar(total=total, initial=initial, desc='Processing', unit='frame', dynamic_ncols=True, bar_format=progress_bar_format)
+    progress.set_postfix({'execution_providers': modules.globals.execution_providers, 'execution_threads': modules.globals.execution_threads, 'max_memory': modules.globals.max_memory})
+    return progress
+
+
+def get_stage_name(process_frames: Callable[[str, List[str], Any], None]) -> str:
+    return process_frames.__module__.split('.')[-1]
+
+
+def get_frame_processor_name(frame_processor: ModuleType) -> str:
+    return frame_processor.__name__.split('.')[-1]
+
+
+def get_fused_stage_name(frame_processors: List[ModuleType]) -> str:
+    return '+'.join(get_frame_processor_name(frame_processor) for frame_processor in frame_processors)
+
+
+def get_pending_frame_paths(frame_paths: List[str], stage: str) -> Tuple[List[str], Optional[Callable[[str], None]]]:
+    target_path = modules.globals.target_path
+    if modules.globals.checkpoint and not modules.globals.map_faces and has_checkpoint(target_path):
+        completed_frames = get_completed_frames(target_path, stage)
+        pending_frame_paths = [frame_path for frame_path in frame_paths if os.path.basename(frame_path) not in completed_frames]
+        return pending_frame_paths, lambda temp_frame_path: mark_frame_completed(target_path, stage, temp_frame_path)
+    return frame_paths, None
+
+
+def process_video(source_path: str, frame_paths: list[str], process_frames: Callable[[str, List[str], Any], None]) -> None:
+    pending_frame_paths, on_frame_done = get_pending_frame_paths(frame_paths, get_stage_name(process_frames))
+    with create_progress_bar(len(frame_paths), len(frame_paths) - len(pending_frame_paths), get_stage_name(process_frames)) as progress:
+        # mapped faces are looked up by frame path, so those frames stay with the module's own process_frames
+        if modules.globals.map_faces:
+            multi_process_frame(source_path, pending_frame_paths, process_frames, progress)
+        elif modules.globals.execution_mode == 'process':
+            pooled_process_frame(source_path, pending_frame_paths, [get_stage_name(process_frames)], progress, on_frame_done)
+        else:
+            staged_process_frame(source_path, pending_frame_paths, [sys.modules[process_frames.__module__]], progress, on_frame_done)
+
+
+def process_video_fused(source_path: str, frame_paths: List[str], frame_processors: List[ModuleType]) -> bool:
+    """
+    Run the whole processor chain in one pass over the temp frames, False if any frame was not written
+    """
+    pending_frame_paths, on_frame_done = get_pending_frame_paths(frame_paths, get_fused_stage_name(frame_processors))
+    with create_progress_bar(len(frame_paths), len(frame_paths) - len(pending_frame_paths), get_fused_stage_name(frame_processors)) as progress:
+        try:
+            if modules.globals.execution_mode == 'process':
+                pooled_process_frame(source_path, pending_frame_paths, [get_frame_processor_name(frame_processor) for frame_processor in frame_processors], progress, on_frame_done)
+            else:
+                staged_process_frame(source_path, pending_frame_paths, frame_processors, progress, on_frame_done)
+        except RuntimeError as exception:
+            # failed frames of the pipeline and dead pool workers alike
+            print(exception)
+            return False
+        # the progress only counts frames once they are written and journaled
+        return progress.n >= len(frame_paths)
+
+
+def pooled_process_frame(source_path: str, temp_frame_paths: List[str], frame_processor_names: List[str], progress: Any = None, on_frame_done: Optional[Callable[[str], None]] = None) -> None:
+    def finish_frame(temp_frame_path: str) -> None:
+        if on_frame_done:
+            on_frame_done(temp_frame_path)
+        if progress:
+            progress.update(1)
+
+    frame_process_pool = FrameProcessPool(source_path, frame_processor_names, modules.globals.execution_threads)
+    try:
+        frame_process_pool.process_paths(temp_frame_paths, finish_frame)
+    finally:
+        frame_process_pool.close()
+
+
+def get_source_face(source_path: str) -> Any:
+    if not source_path:
+        return None
+    return get_one_face(cv2.imread(source_path))
+
+
+def run_frame_processors(frame_processors: List[ModuleType], source_face: Any, temp_frame: Frame) -> Frame:
+    # one frame context per frame, so the processors of the chain share a single face detection
+    with use_frame_context(FrameContext()):
+        try:
+            for frame_processor in frame_processors:
+                with span(frame_processor.NAME, 'processor'):
+                    temp_frame = frame_processor.process_frame(source_face, temp_frame)
+        except Exception as exception:
+            print(exception)
+    return temp_frame
+
+
+def map_ordered(executor: ThreadPoolExecutor, function: Callable[[Any], Any], items: Iterable[Any], window: int, reuse: Optional[Callable[[Any], bool]] = None) -> Iterator[Any]:
+    pending: Deque[Future[Any]] = deque()
+    previous_future = None
+    for item in items:
+        # items flagged for reuse yield the result of the previously submitted item
+        if reuse and previous_future and reuse(item):
+            pending.append(previous_future)
+        else:
+            previous_future = executor.submit(function, item)
+            pending.append(previous_future)
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def process_video_stream(source_path: str, target_path: str, output_path: str, fps: float, frame_processors: List[ModuleType], audio_path: Optional[str] = None, encoder_args: Optional[List[str]] = None, frame_filter: Optional[Callable[[int], bool]] = None, preview_path: Optional[str] = None) -> bool:
+    if modules.globals.execution_mode == 'process':
+        return process_video_stream_in_processes(source_path, target_path, output_path, fps, frame_processors, audio_path, encoder_args, frame_filter, preview_path)
+    width, height = detect_resolution(target_path)
+    source_face = get_source_face(source_path)
+
+    def process_stream_frame(item: Tuple[int, Frame]) -> Frame:
+        frame_number, temp_frame = item
+        if frame_filter and not frame_filter(frame_number):
+            return temp_frame
+        if modules.globals.face_prescan and not has_face(temp_frame):
+            return temp_frame
+        return run_frame_processors(frame_processors, source_face, temp_frame)
+
+    return run_video_stream(target_path, output_path, width, height, fps, 'bgr24', process_stream_frame, get_frame_signature, audio_path, encoder_args, preview_path)
+
+
+def process_video_stream_in_processes(source_path: str, target_path: str, output_path: str, fps: float, frame_processors: List[ModuleType], audio_path: Optional[str] = None, encoder_args: Optional[List[str]] = None, frame_filter: Optional[Callable[[int], bool]] = None, preview_path: Optional[str] = None) -> bool:
+    width, height = detect_resolution(target_path)
+    frame_processor_names = [get_frame_processor_name(frame_processor) for frame_processor in frame_processors]
+    frame_process_pool = FrameProcessPool(source_path, frame_processor_names, modules.globals.execution_threads, (height, width, 3))
+    reader = open_frame_reader(target_path, width, height)
+    writer = open_frame_writer(output_path, width, height, fps, audio_path, encoder_args, preview_path)
+    items = ((frame_number, temp_frame, not frame_filter or frame_filter(frame_number)) for frame_number, temp_frame in enumerate(read_raw_frames(reader, width, height)))
+    written = False
+    try:
+        with create_progress_bar(get_video_frame_total(target_path), stage='stream') as progress:
+            for temp_frame in frame_process_pool.process_frames(items):
+                writer.stdin.write(numpy.ascontiguousarray(temp_frame).tobytes())
+                progress.update(1)
+        written = True
+    except BrokenPipeError:
+        # the encoder went away, its exit code is reported by ffmpeg itself
+        pass
+    except RuntimeError as exception:
+        # a frame worker failed or died
+        print(exception)
+    finally:
+        reader.stdout.close()
+        reader.wait()
+        encoded = close_frame_writer(writer)
+        frame_process_pool.close()
+    return written and encoded
+
+
+def process_video_yuv(source_path: str, target_path: str, output_path: str, fps: float, frame_processors: List[ModuleType], audio_path: Optional[str] = None, encoder_args: Optional[List[str]] = None, frame_filter: Optional[Callable[[int], bool]] = None, preview_path: Optional[str] = None) -> bool:
+    """
+    Keep frames as yuv420p planes from decoder to encoder and convert only the face regions to bgr
+    """
+    width, height = detect_resolution(target_path)
+    if width % 2 or height % 2:
+        return process_video_stream(source_path, target_path, output_path, fps, frame_processors, audio_path, encoder_args, frame_filter, preview_path)
+    source_face = get_source_face(source_path)
+
+    def process_yuv_frame(item: Tuple[int, Frame]) -> Frame:
+        frame_number, temp_frame = item
+        if frame_filter and not frame_filter(frame_number):
+            return temp_frame
+        planes = get_yuv_planes(temp_frame, width, height)
+        for roi in get_face_rois(planes, width, height):
+            write_yuv_roi(planes, roi, run_frame_processors(frame_processors, source_face, read_yuv_roi(planes, roi)))
+        return temp_frame
+
+    def get_yuv_signature(temp_frame: Frame) -> Any:
+        return get_luma_signature(get_yuv_planes(temp_frame, width, height)[0])
+
+    return run_video_stream(target_path, output_path, width, height, fps, 'yuv420p', process_yuv_frame, get_yuv_signature, audio_path, encoder_args, preview_path)
+
+
+def process_video_draft(source_path: str, target_path: str, output_path: str, fps: float, frame_processors: List[ModuleType], audio_path: Optional[str] = None) -> bool:
+    """
+    Render a full length low resolution preview, processing every n-th frame only
+    """
+    width, height = detect_resolution(target_path)
+    draft_height = min(height, modules.globals.draft_height) // 2 * 2
+    draft_width = round(width * draft_height / height / 2) * 2
+    stride = max(1, modules.globals.draft_stride)
+    # the enhancer costs more than the swap and its detail is lost at draft resolution
+    frame_processors = [frame_processor for frame_processor in frame_processors if get_frame_processor_name(frame_processor) != 'face_enhancer']
+    source_face = get_source_face(source_path)
+
+    def process_draft_frame(item: Tuple[int, Frame]) -> Tuple[bool, Frame]:
+        frame_number, temp_frame = item
+        if frame_number % stride:
+            return False, temp_frame
+        return True, run_frame_processors(frame_processors, source_face, temp_frame)
+
+    reader = open_frame_reader(target_path, draft_width, draft_height)
+    writer = open_frame_writer(output_path, draft_width, draft_height, fps, audio_path, get_draft_encoder_args())
+
+    def write_frame(temp_frame: Frame) -> None:
+        writer.stdin.write(numpy.ascontiguousarray(temp_frame).tobytes())
+        progress.update(1)
+
+    written = False
+    try:
+        with create_progress_bar(get_video_frame_total(target_path), stage='draft') as progress, ThreadPoolExecutor(max_workers=modules.globals.execution_threads) as executor:
+            previous_frame = None
+            skipped_frames: List[Frame] = []
+            for processed, temp_frame in map_ordered(executor, process_draft_frame, enumerate(read_raw_frames(reader, draft_width, draft_height)), modules.globals.execution_threads * 2):
+                if not processed:
+                    if modules.globals.draft_fill == 'blend':
+                        skipped_frames.append(temp_frame)
+                    else:
+                        write_frame(temp_frame if previous_frame is None else previous_frame)
+                    continue
+                # cross fade the skipped frames from the previous processed frame to this one
+                for index, skipped_frame in enumerate(skipped_frames, start=1):
+                    weight = index / (len(skipped_frames) + 1)
+                    write_frame(skipped_frame if previous_frame is None else cv2.addWeighted(previous_frame, 1 - weight, temp_frame, weight, 0))
+                skipped_frames.clear()
+                write_frame(temp_frame)
+                previous_frame = temp_frame
+            for skipped_frame in skipped_frames:
+                write_frame(skipped_frame if previous_frame is None else previous_frame)
+        written = True
+    except BrokenPipeError:
+        pass
+    finally:
+        reader.stdout.close()
+        reader.wait()
+        encoded = close_frame_writer(writer)
+    return written and encoded
+
+
+def run_video_stream(target_path: str, output_path: str, width: int, height: int, fps: float, pix_fmt: str, process_stream_frame: Callable[[Tuple[int, Frame]], Frame], get_signature: Callable[[Frame], Any], audio_path: Optional[str] = None, encoder_args: Optional[List[str]] = None, preview_path: Optional[str] = None) -> bool:
+    detector = DuplicateFrameDetector(modules.globals.dedup_threshold)
+
+    def reuse_duplicate(item: Tuple[int, Frame]) -> bool:
+        if not detector.is_duplicate_signature(get_signature(item[1])):
+            return False
+        progress.reused += 1
+        return True
+
+    reader = open_frame_reader(target_path, width, height, pix_fmt)
+    writer = open_frame_writer(output_path, width, height, fps, audio_path, encoder_args, preview_path, pix_fmt)
+    written = False
+    try:
+        with create_progress_bar(get_video_frame_total(target_path), stage='stream') as progress, ThreadPoolExecutor(max_workers=modules.globals.execution_threads) as executor:
+            for temp_frame in map_ordered(executor, process_stream_frame, enumerate(read_raw_frames(reader, width, height, pix_fmt)), modules.globals.execution_threads * 2, reuse_duplicate if modules.globals.frame_dedup else None):
+                writer.stdin.write(numpy.ascontiguousarray(temp_frame).tobytes())
+                progress.update(1)
+        written = True
+    except BrokenPipeError:
+        pass
+    finally:
+        reader.stdout.close()
+        reader.wait()
+        encoded = close_frame_writer(writer)
+    return written and encoded
@@ -1,5 +1,6 @@
-from typing import Any, List
+from typing import Any, List, Optional
 import cv2
+import numpy
 import threading
 import gfpgan
 import os
@@ -8,7 +9,11 @@ import modules.globals
 import modules.processors.frame.core
 from modules.core import update_status
 from modules.face_analyser import get_one_face
+from modules.frame_context import get_frame_context
+from modules.metrics import measure
+from modules.tracer import traced_lock
 from modules.custom_types import Frame, Face
+from modules.frame_store import read_frame, write_frame
 from modules.utilities import (
     conditional_download,
     is_image,
@@ -46,23 +51,39 @@ def pre_start() -> bool:
 def get_face_enhancer() -> Any:
     global FACE_ENHANCER
 
-    with THREAD_LOCK:
+    with traced_lock(THREAD_LOCK, 'face_enhancer.THREAD_LOCK'):
         if FACE_ENHANCER is None:
             model_path = os.path.join(models_dir, 'GFPGANv1.4.pth')
             FACE_ENHANCER = gfpgan.GFPGANer(model_path=model_path, upscale=1)  # type: ignore[attr-defined]
     return FACE_ENHANCER
 
 
-def enhance_face(temp_frame: Frame) -> Frame:
-    with THREAD_SEMAPHORE:
-        _, _, temp_frame = get_face_enhancer().enhance(temp_frame, paste_back=True)
+def enhance_face(temp_frame: Frame, landmarks: Optional[List[Any]] = None) -> Frame:
+    with traced_lock(THREAD_SEMAPHORE, 'face_enhancer.THREAD_SEMAPHORE'), measure('gfpgan'):
+        face_enhancer = get_face_enhancer()
+        if landmarks is None:
+            _, _, temp_frame = face_enhancer.enhance(temp_frame, paste_back=True)
+            return temp_frame
+        # hand the known five point landmarks to the face helper instead of running its own detector
+        face_helper = face_enhancer.face_helper
+
+        def get_face_landmarks_5(*args: Any, **kwargs: Any) -> int:
+            face_helper.all_landmarks_5 = [numpy.asarray(landmark, dtype=numpy.float32) for landmark in landmarks]
+            return len(face_helper.all_landmarks_5)
+
+        face_helper.get_face_landmarks_5 = get_face_landmarks_5
+        try:
+            _, _, temp_frame = face_enhancer.enhance(temp_frame, paste_back=True)
+        finally:
+            del face_helper.get_face_landmarks_5
     return temp_frame
 
 
 def process_frame(source_face: Face, temp_frame: Frame) -> Frame:
     target_face = get_one_face(temp_frame)
     if target_face:
-        temp_frame = enhance_face(temp_frame)
+        frame_context = get_frame_context()
+        temp_frame = enhance_face(temp_frame, frame_context.get_landmarks(temp_frame) if frame_context else None)
     return temp_frame
 
 
@@ -70,9 +91,9 @@ def process_frames(
     source_path: str, temp_frame_paths: List[str], progress: Any = None
 ) -> None:
     for temp_frame_path in temp_frame_paths:
-        temp_frame = cv2.imread(temp_frame_path)
+        temp_frame = read_frame(temp_frame_path)
         result = process_frame(None, temp_frame)
-        cv2.imwrite(temp_frame_path, result)
+        write_frame(temp_frame_path, result)
         if progress:
             progress.update(1)
 
@@ -1,13 +1,15 @@
 from typing import Any, List
 import cv2
-import insightface
+from insightface.model_zoo.inswapper import INSwapper
 import threading
+import time
 import numpy as np
 import modules.globals
 import modules.processors.frame.core
 from modules.core import update_status
 from modules.face_analyser import get_one_face, get_many_faces, default_source_face
 from modules.custom_types import Face, Frame
+from modules.frame_store import read_frame, write_frame
 from modules.utilities import (
     conditional_download,
     is_image,
@@ -15,6 +17,8 @@ from modules.utilities import (
 )
 from modules.cluster_analysis import find_closest_centroid
 from modules.memory_optimizer import memory_optimizer
+from modules.metrics import MeasuredSession, measure, observe, get_last_session_seconds
+from modules.tracer import traced_lock
 import os
 
 FACE_SWAPPER = None
@@ -55,24 +59,14 @@ def pre_start() -> bool:
 def get_face_swapper() -> Any:
     global FACE_SWAPPER
 
-    with THREAD_LOCK:
+    with traced_lock(THREAD_LOCK, 'face_swapper.THREAD_LOCK'):
         if FACE_SWAPPER is None:
             model_path = os.path.join(models_dir, 'inswapper_128_fp16.onnx')
             
-            # Get optimized session options and provider options
-            session_options = memory_optimizer.get_optimized_onnx_session_options()
-            provider_options = memory_optimizer.get_optimized_gpu_provider_options()
-            
-            # Create providers list with optimized options
-            providers = modules.globals.execution_providers.copy()
-            if 'CUDAExecutionProvider' in providers and provider_options:
-                providers = [('CUDAExecutionProvider', provider_options)] + [p for p in providers if p != 'CUDAExecutionProvider']
-            
-            FACE_SWAPPER = insightface.model_zoo.get_model(
-                model_path, 
-                providers=providers,
-                session_options=session_options
-            )
+            # Our own session, so the session options of the thread budget are applied
+            FACE_SWAPPER = INSwapper(model_file=model_path, session=memory_optimizer.create_onnx_session(model_path))
+            # time the inference on its own, the rest of a swap is alignment and paste back
+            FACE_SWAPPER.session = MeasuredSession(FACE_SWAPPER.session, 'inswapper')
     return FACE_SWAPPER
 
 
@@ -80,23 +74,26 @@ def swap_face(source_face: Face, target_face: Face, temp_frame: Frame) -> Frame:
     face_swapper = get_face_swapper()
 
     # Apply the face swap
+    started = time.perf_counter()
     swapped_frame = face_swapper.get(
         temp_frame, target_face, source_face, paste_back=True
     )
+    observe('paste_back', time.perf_counter() - started - get_last_session_seconds())
 
     if modules.globals.mouth_mask:
-        # Create a mask for the target face
-        face_mask = create_face_mask(target_face, temp_frame)
+        with measure('mask'):
+            # Create a mask for the target face
+            face_mask = create_face_mask(target_face, temp_frame)
 
-        # Create the mouth mask
-        mouth_mask, mouth_cutout, mouth_box, lower_lip_polygon = (
-            create_lower_mouth_mask(target_face, temp_frame)
-        )
+            # Create the mouth mask
+            mouth_mask, mouth_cutout, mouth_box, lower_lip_polygon = (
+                create_lower_mouth_mask(target_face, temp_frame)
+            )
 
-        # Apply the mouth area
-        swapped_frame = apply_mouth_area(
-            swapped_frame, mouth_cutout, mouth_box, face_mask, lower_lip_polygon
-        )
+            # Apply the mouth area
+            swapped_frame = apply_mouth_area(
+                swapped_frame, mouth_cutout, mouth_box, face_mask, lower_lip_polygon
+            )
 
         if modules.globals.show_mouth_mask_box:
             mouth_mask_data = (mouth_mask, mouth_cutout, mouth_box, lower_lip_polygon)
@@ -219,10 +216,10 @@ def process_frames(
     if not modules.globals.map_faces:
         source_face = get_one_face(cv2.imread(source_path))
         for temp_frame_path in temp_frame_paths:
-            temp_frame = cv2.imread(temp_frame_path)
+            temp_frame = read_frame(temp_frame_path)
             try:
                 result = process_frame(source_face, temp_frame)
-                cv2.imwrite(temp_frame_path, result)
+                write_frame(temp_frame_path, result)
             except Exception as exception:
                 print(exception)
                 pass
@@ -230,10 +227,10 @@ def process_frames(
                 progress.update(1)
     else:
         for temp_frame_path in temp_frame_paths:
-            temp_frame = cv2.imread(temp_frame_path)
+            temp_frame = read_frame(temp_frame_path)
             try:
                 result = process_frame_v2(temp_frame, temp_frame_path)
-                cv2.imwrite(temp_frame_path, result)
+                write_frame(temp_frame_path, result)
             except Exception as exception:
                 print(exception)
                 pass
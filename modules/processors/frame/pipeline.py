@@ -0,0 +1,86 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+from modules.metrics import ACTIVE_WORKERS, QUEUE_DEPTH, add_collector, remove_collector
+
+# sentinel that tells a stage worker no more items will arrive
+STOP = object()
+
+StageFunction = Callable[[Any], Any]
+
+
+class FramePipelineError(RuntimeError):
+    """
+    Items that failed in a stage, raised once the pipeline has drained so the other items still finish
+    """
+
+    def __init__(self, failures: List[Tuple[str, Any, Exception]]):
+        self.failures = failures
+        name, _, exception = failures[0]
+        super().__init__(f'{len(failures)} items failed in the frame pipeline, first in {name}: {exception}')
+
+
+class FramePipeline:
+    """
+    Stages connected by bounded queues, every stage runs its own number of workers
+    """
+
+    def __init__(self, stages: List[Tuple[str, StageFunction, int]], queue_size: int):
+        self.stages = [(name, function, max(1, workers)) for name, function, workers in stages]
+        # a full queue blocks the stage feeding it, so memory stays bounded however long the video is
+        self.queues: List['queue.Queue[Any]'] = [queue.Queue(maxsize=max(1, queue_size)) for _ in self.stages]
+        self.failures: List[Tuple[str, Any, Exception]] = []
+        self.failures_lock = threading.Lock()
+
+    def run_stage(self, name: str, function: StageFunction, input_queue: 'queue.Queue[Any]', output_queue: Optional['queue.Queue[Any]']) -> None:
+        while True:
+            item = input_queue.get()
+            if item is STOP:
+                return
+            ACTIVE_WORKERS.add(name, 1)
+            try:
+                result = function(item)
+            except Exception as exception:
+                # a dead worker would stall the stages around it, drop the item and report it once drained
+                print(exception)
+                with self.failures_lock:
+                    self.failures.append((name, item, exception))
+                continue
+            finally:
+                ACTIVE_WORKERS.add(name, -1)
+            if output_queue is not None and result is not None:
+                output_queue.put(result)
+
+    def collect_queue_depths(self) -> None:
+        for (name, _, _), stage_queue in zip(self.stages, self.queues):
+            QUEUE_DEPTH.set(name, stage_queue.qsize())
+
+    def run(self, items: Iterable[Any]) -> None:
+        self.failures = []
+        add_collector(self.collect_queue_depths)
+        try:
+            self.run_stages(items)
+        finally:
+            remove_collector(self.collect_queue_depths)
+            for name, _, _ in self.stages:
+                QUEUE_DEPTH.set(name, 0)
+        if self.failures:
+            raise FramePipelineError(self.failures)
+
+    def run_stages(self, items: Iterable[Any]) -> None:
+        stage_threads = []
+        for index, (name, function, workers) in enumerate(self.stages):
+            output_queue = self.queues[index + 1] if index + 1 < len(self.stages) else None
+            threads = [threading.Thread(target=self.run_stage, args=(name, function, self.queues[index], output_queue), name=f'{name}-{worker}', daemon=True) for worker in range(workers)]
+            for thread in threads:
+                thread.start()
+            stage_threads.append(threads)
+        for item in items:
+            self.queues[0].put(item)
+        # stop the stages front to back so every item ahead of the sentinels drains first
+        for index, threads in enumerate(stage_threads):
+            for _ in threads:
+                self.queues[index].put(STOP)
+            for thread in threads:
+                thread.join()
@@ -0,0 +1,202 @@
+import queue
+import multiprocessing
+from collections import deque
+from multiprocessing import shared_memory
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy
+
+import modules.globals
+from modules.custom_types import Frame
+from modules.frame_store import read_frame, write_frame
+from modules.thread_budget import create_thread_budget, get_worker_thread_budget, apply_thread_budget
+from modules.utilities import get_globals_snapshot, apply_globals_snapshot
+
+# how often a parent waiting on results checks that its workers are still alive
+RESULT_POLL_SECONDS = 1.0
+
+
+class FrameRing:
+    """
+    Fixed size frame slots in shared memory, frames are copied in and out instead of pickled
+    """
+
+    def __init__(self, slot_count: int, frame_shape: Tuple[int, ...], name: Optional[str] = None):
+        self.slot_count = slot_count
+        self.frame_shape = frame_shape
+        # spawned workers share the resource tracker of the owner, which unregisters the block when it unlinks it
+        self.shared_memory = shared_memory.SharedMemory(name=name, create=name is None, size=slot_count * int(numpy.prod(frame_shape)))
+        self.frames = numpy.ndarray((slot_count,) + tuple(frame_shape), dtype=numpy.uint8, buffer=self.shared_memory.buf)
+
+    @property
+    def name(self) -> str:
+        return self.shared_memory.name
+
+    def close(self, unlink: bool = False) -> None:
+        # the array view has to go before the buffer it points into can be released
+        del self.frames
+        self.shared_memory.close()
+        if unlink:
+            self.shared_memory.unlink()
+
+
+def run_worker(settings: Dict[str, Any], worker_index: int, worker_count: int, source_path: str, frame_processor_names: List[str], ring_name: Optional[str], slot_count: int, frame_shape: Tuple[int, ...], task_queue: Any, result_queue: Any) -> None:
+    apply_globals_snapshot(settings)
+    if modules.globals.thread_budget == 'auto':
+        # before any model loads, the sessions take their thread counts from the budget
+        apply_thread_budget(get_worker_thread_budget(create_thread_budget(worker_count), worker_index), modules.globals.cpu_affinity)
+    from modules.face_presence import has_face
+    from modules.processors.frame.core import load_frame_processor_module, get_source_face, run_frame_processors
+
+    try:
+        frame_processors = [load_frame_processor_module(frame_processor_name) for frame_processor_name in frame_processor_names]
+        source_face = get_source_face(source_path)
+        frame_ring = FrameRing(slot_count, frame_shape, ring_name) if ring_name else None
+    except Exception as exception:
+        # the parent waits on results, so a worker that cannot start has to tell it
+        result_queue.put((None, None, f'worker {worker_index} failed to start: {exception}'))
+        return
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        key, slot = task
+        try:
+            # tasks carry either a ring slot or the path of a temp frame
+            temp_frame = frame_ring.frames[slot] if frame_ring and slot is not None else read_frame(key)
+            if not modules.globals.face_prescan or has_face(temp_frame):
+                temp_frame = run_frame_processors(frame_processors, source_face, temp_frame)
+            if frame_ring and slot is not None:
+                frame_ring.frames[slot] = temp_frame
+            else:
+                write_frame(key, temp_frame)
+        except Exception as exception:
+            result_queue.put((key, slot, str(exception)))
+            continue
+        result_queue.put((key, slot, None))
+    if frame_ring:
+        frame_ring.close()
+
+
+class FrameProcessPool:
+    """
+    Worker processes with their own models, so python side work does not contend for one interpreter lock
+    """
+
+    def __init__(self, source_path: str, frame_processor_names: List[str], worker_count: int, frame_shape: Optional[Tuple[int, ...]] = None):
+        context = multiprocessing.get_context('spawn')
+        self.worker_count = max(1, worker_count)
+        self.failed = False
+        self.task_queue = context.Queue()
+        self.result_queue = context.Queue()
+        # two slots per worker keep every worker busy while finished frames wait for their turn
+        self.slot_count = self.worker_count * 2
+        self.frame_ring = FrameRing(self.slot_count, frame_shape) if frame_shape else None
+        settings = get_globals_snapshot()
+        settings['headless'] = True
+        settings['execution_threads'] = 1
+        ring_name = self.frame_ring.name if self.frame_ring else None
+        self.workers = [context.Process(target=run_worker, args=(settings, worker_index, self.worker_count, source_path, frame_processor_names, ring_name, self.slot_count, frame_shape, self.task_queue, self.result_queue), daemon=True) for worker_index in range(self.worker_count)]
+        for worker in self.workers:
+            worker.start()
+
+    def get_result(self) -> Tuple[Any, Optional[int]]:
+        """
+        Wait for the next finished task, raise when a worker failed or died instead of waiting forever
+        """
+        while True:
+            try:
+                return self.unpack_result(self.result_queue.get(timeout=RESULT_POLL_SECONDS))
+            except queue.Empty:
+                for worker in self.workers:
+                    if not worker.is_alive():
+                        self.failed = True
+                        raise RuntimeError(f'frame worker {worker.pid} exited with code {worker.exitcode}')
+
+    def poll_result(self) -> Optional[Tuple[Any, Optional[int]]]:
+        try:
+            return self.unpack_result(self.result_queue.get_nowait())
+        except queue.Empty:
+            return None
+
+    def unpack_result(self, result: Tuple[Any, Optional[int], Optional[str]]) -> Tuple[Any, Optional[int]]:
+        key, slot, error = result
+        if error is not None:
+            self.failed = True
+            raise RuntimeError(f'frame worker failed on {key}: {error}')
+        return key, slot
+
+    def process_paths(self, temp_frame_paths: List[str], on_frame_done: Optional[Callable[[str], None]] = None) -> None:
+        for temp_frame_path in temp_frame_paths:
+            self.task_queue.put((temp_frame_path, None))
+        for _ in temp_frame_paths:
+            temp_frame_path, _ = self.get_result()
+            if on_frame_done:
+                on_frame_done(temp_frame_path)
+
+    def process_frames(self, items: Iterator[Tuple[int, Frame, bool]]) -> Iterator[Frame]:
+        """
+        Yield the frames in order, frames not flagged for processing bypass the workers
+        """
+        if self.frame_ring is None:
+            raise ValueError('frame pool was created without a frame shape')
+        free_slots: Deque[int] = deque(range(self.slot_count))
+        finished: Dict[int, Any] = {}
+        next_frame_number = 0
+        pending_count = 0
+
+        def collect(result: Tuple[Any, Optional[int]]) -> None:
+            nonlocal pending_count
+            frame_number, slot = result
+            finished[frame_number] = slot
+            pending_count -= 1
+
+        def release() -> Iterator[Frame]:
+            nonlocal next_frame_number
+            while next_frame_number in finished:
+                result = finished.pop(next_frame_number)
+                if isinstance(result, int):
+                    # the slot is reused only after the consumer is done with the view
+                    yield self.frame_ring.frames[result]
+                    free_slots.append(result)
+                else:
+                    yield result
+                next_frame_number += 1
+
+        for frame_number, temp_frame, needs_processing in items:
+            if not needs_processing:
+                finished[frame_number] = temp_frame
+            else:
+                while not free_slots:
+                    collect(self.get_result())
+                    yield from release()
+                slot = free_slots.popleft()
+                self.frame_ring.frames[slot] = temp_frame
+                self.task_queue.put((frame_number, slot))
+                pending_count += 1
+            # take whatever is done without waiting, frames behind a pending one would pile up otherwise
+            result = self.poll_result() if pending_count else None
+            while result is not None:
+                collect(result)
+                result = self.poll_result() if pending_count else None
+            # pass through frames stay decoded in memory, past the ring size the reader waits for the pending head
+            while pending_count and len(finished) > self.slot_count and next_frame_number not in finished:
+                collect(self.get_result())
+            yield from release()
+        while pending_count:
+            collect(self.get_result())
+            yield from release()
+        yield from release()
+
+    def close(self) -> None:
+        if self.failed:
+            # the queued tasks are no longer wanted, waiting for the workers to drain them would only delay the error
+            for worker in self.workers:
+                worker.terminate()
+        else:
+            for _ in self.workers:
+                self.task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        if self.frame_ring:
+            self.frame_ring.close(unlink=True)
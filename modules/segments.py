@@ -0,0 +1,179 @@
+import os
+import glob
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import modules.globals
+from modules.probe import probe_media, probe_keyframes
+from modules.thread_budget import create_thread_budget, apply_thread_budget
+from modules.utilities import run_ffmpeg, get_temp_directory_path, get_temp_preview_path, get_globals_snapshot, apply_globals_snapshot, get_video_encoder_args, get_preview_args, get_preview_filter
+
+SEGMENTS_DIRECTORY = 'segments'
+# encoders that can produce segments spliceable with stream copied source segments
+SPLICE_ENCODERS = {
+    'h264': ('libx264', '-x264-params', 'h264_mp4toannexb'),
+    'hevc': ('libx265', '-x265-params', 'hevc_mp4toannexb'),
+}
+
+
+def parse_time(value: Union[str, float]) -> float:
+    # json bodies send plain seconds as numbers
+    seconds = 0.0
+    for part in str(value).strip().split(':'):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def parse_time_range(range_start: Optional[Union[str, float]], range_end: Optional[Union[str, float]]) -> List[float]:
+    time_range = [parse_time(range_start) if str(range_start or '').strip() else 0.0, parse_time(range_end) if str(range_end or '').strip() else float('inf')]
+    if time_range[0] >= time_range[1]:
+        raise ValueError(f'time range ends before it starts: {range_start}-{range_end}')
+    return time_range
+
+
+def parse_time_ranges(start: Optional[Union[str, float]] = None, end: Optional[Union[str, float]] = None, ranges: Optional[str] = None) -> List[List[float]]:
+    """
+    Parse --start/--end and a comma separated list of START-END ranges into [start, end] seconds
+    """
+    time_ranges = []
+    if start or end:
+        time_ranges.append(parse_time_range(start, end))
+    for time_range in str(ranges or '').split(','):
+        if time_range.strip():
+            range_start, _, range_end = time_range.partition('-')
+            time_ranges.append(parse_time_range(range_start, range_end))
+    return sorted(time_ranges)
+
+
+def snap_time_ranges(time_ranges: List[List[float]], keyframes: List[float], duration: float) -> List[Tuple[float, float]]:
+    """
+    Widen every range to the gops covering it and merge the overlapping ones
+    """
+    snapped_ranges: List[Tuple[float, float]] = []
+    for range_start, range_end in time_ranges:
+        snapped_start = max([keyframe for keyframe in keyframes if keyframe <= range_start] or [0.0])
+        snapped_end = min([keyframe for keyframe in keyframes if keyframe > min(range_end, duration)] or [duration])
+        if snapped_ranges and snapped_start <= snapped_ranges[-1][1]:
+            snapped_ranges[-1] = (snapped_ranges[-1][0], max(snapped_ranges[-1][1], snapped_end))
+        elif snapped_start < snapped_end:
+            snapped_ranges.append((snapped_start, snapped_end))
+    return snapped_ranges
+
+
+def is_in_time_ranges(frame_number: int, fps: float, time_ranges: List[List[float]]) -> bool:
+    frame_time = frame_number / fps
+    return any(range_start <= frame_time < range_end for range_start, range_end in time_ranges)
+
+
+def choose_split_times(keyframes: List[float], duration: float, segment_count: int) -> List[float]:
+    candidates = [keyframe for keyframe in keyframes if keyframe > 0]
+    split_times: List[float] = []
+    for index in range(1, segment_count):
+        if not candidates:
+            break
+        split_time = min(candidates, key=lambda keyframe: abs(keyframe - duration * index / segment_count))
+        if split_time not in split_times:
+            split_times.append(split_time)
+    return sorted(split_times)
+
+
+def split_video(target_path: str, split_times: List[float], directory_path: str, bitstream_filter: Optional[str] = None) -> List[str]:
+    args = ['-i', target_path, '-map', '0:v:0', '-c', 'copy', '-f', 'segment', '-reset_timestamps', '1']
+    if bitstream_filter:
+        args.extend(['-bsf:v', bitstream_filter])
+    if split_times:
+        # the segment muxer cuts at the first keyframe at or after each time
+        args.extend(['-segment_times', ','.join(f'{split_time - 0.001:.3f}' for split_time in split_times)])
+    args.extend(['-y', os.path.join(directory_path, 'segment_%03d.mkv')])
+    run_ffmpeg(args)
+    return sorted(glob.glob(os.path.join(glob.escape(directory_path), 'segment_*.mkv')))
+
+
+def concat_videos(video_paths: List[str], output_path: str, audio_path: Optional[str] = None, preview_path: Optional[str] = None) -> bool:
+    concat_list_path = os.path.splitext(output_path)[0] + '_concat.txt'
+    with open(concat_list_path, 'w') as concat_list:
+        for video_path in video_paths:
+            escaped_path = os.path.abspath(video_path).replace("'", "'\\''")
+            concat_list.write(f"file '{escaped_path}'\n")
+    args = ['-f', 'concat', '-safe', '0', '-i', concat_list_path]
+    if audio_path:
+        args.extend(['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0?', '-shortest'])
+    args.extend(['-c', 'copy', '-y', output_path])
+    if preview_path:
+        # the preview is the only part re-encoded, the master stays stream copied
+        args.extend(get_preview_args(preview_path, '0:v:0', get_preview_filter()))
+    done = run_ffmpeg(args)
+    os.remove(concat_list_path)
+    return done
+
+
+def process_segment(settings: Dict[str, Any], segment_count: int, source_path: str, segment_path: str, output_path: str, fps: float) -> bool:
+    apply_globals_snapshot(settings)
+    if modules.globals.thread_budget == 'auto':
+        # the segment processes share the cores, so the budget counts the workers of all of them
+        apply_thread_budget(create_thread_budget(modules.globals.execution_threads * segment_count))
+    from modules.processors.frame.core import get_frame_processors_modules, process_video_stream, process_video_yuv
+
+    process_video = process_video_yuv if modules.globals.video_pipeline == 'yuv' else process_video_stream
+    return process_video(source_path, segment_path, output_path, fps, get_frame_processors_modules(modules.globals.frame_processors))
+
+
+def process_video_ranges(source_path: str, target_path: str, output_path: str, time_ranges: List[List[float]]) -> bool:
+    """
+    Process only the gops covering the time ranges and stream copy everything else
+    """
+    from modules.processors.frame.core import get_frame_processors_modules, process_video_stream
+
+    probe = probe_media(target_path)
+    # processed segments come out autorotated, the stream copied ones would keep the rotation and turn with it
+    if probe['codec'] not in SPLICE_ENCODERS or probe['pix_fmt'] != 'yuv420p' or probe['rotation']:
+        return False
+    video_encoder, encoder_params_flag, bitstream_filter = SPLICE_ENCODERS[probe['codec']]
+    snapped_ranges = snap_time_ranges(time_ranges, probe_keyframes(target_path), probe['duration'])
+    split_times = sorted({split_time for snapped_range in snapped_ranges for split_time in snapped_range if 0 < split_time < probe['duration']})
+    segments_directory_path = os.path.join(get_temp_directory_path(target_path), SEGMENTS_DIRECTORY)
+    os.makedirs(segments_directory_path, exist_ok=True)
+    segment_paths = split_video(target_path, split_times, segments_directory_path, bitstream_filter)
+    if len(segment_paths) != len(split_times) + 1:
+        return False
+
+    # repeat the parameter sets in band so decoders switch cleanly at every splice
+    encoder_args = get_video_encoder_args(video_encoder) + [encoder_params_flag, 'repeat-headers=1']
+    frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
+    segment_starts = [0.0] + split_times
+    output_paths = []
+    for segment_path, segment_start in zip(segment_paths, segment_starts):
+        if not any(range_start <= segment_start < range_end for range_start, range_end in snapped_ranges):
+            output_paths.append(segment_path)
+            continue
+        processed_path = segment_path.replace('segment_', 'processed_')
+        # the gops reach past the ranges, the frames outside of them pass through untouched
+        segment_start_frame = round(segment_start * probe['fps'])
+        frame_filter = lambda frame_number, start_frame=segment_start_frame: is_in_time_ranges(start_frame + frame_number, probe['fps'], time_ranges)
+        if not process_video_stream(source_path, segment_path, processed_path, probe['fps'], frame_processors, encoder_args=encoder_args, frame_filter=frame_filter):
+            return False
+        output_paths.append(processed_path)
+    return concat_videos(output_paths, output_path, target_path if modules.globals.keep_audio else None, get_temp_preview_path(target_path))
+
+
+def process_video_segments(source_path: str, target_path: str, output_path: str, fps: float, segment_count: int) -> bool:
+    segments_directory_path = os.path.join(get_temp_directory_path(target_path), SEGMENTS_DIRECTORY)
+    os.makedirs(segments_directory_path, exist_ok=True)
+    split_times = choose_split_times(probe_keyframes(target_path), probe_media(target_path)['duration'], segment_count)
+    segment_paths = split_video(target_path, split_times, segments_directory_path)
+    if not segment_paths:
+        return False
+    processed_paths = [os.path.join(segments_directory_path, f'processed_{index:03d}.mp4') for index in range(len(segment_paths))]
+
+    # every worker process loads its own models and encodes its own segment
+    settings = get_globals_snapshot()
+    settings['headless'] = True
+    settings['keep_audio'] = False
+    settings['execution_threads'] = max(1, modules.globals.execution_threads // len(segment_paths))
+    with ProcessPoolExecutor(max_workers=len(segment_paths), mp_context=multiprocessing.get_context('spawn')) as executor:
+        results = list(executor.map(process_segment, repeat(settings), repeat(len(segment_paths)), repeat(source_path), segment_paths, processed_paths, repeat(fps)))
+    if not all(results):
+        return False
+    return concat_videos(processed_paths, output_path, target_path if modules.globals.keep_audio else None, get_temp_preview_path(target_path))
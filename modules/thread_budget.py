@@ -0,0 +1,96 @@
+import os
+from typing import Any, List, Optional
+
+import cv2
+import torch
+
+import modules.globals
+
+CPU_EXECUTION_PROVIDER = 'CPUExecutionProvider'
+
+THREAD_BUDGET = None
+
+
+class ThreadBudget:
+    """
+    Split of the cores between frame workers and the thread pools of onnxruntime, opencv and torch
+    """
+
+    def __init__(self, cores: List[int], workers: int, intra_op_threads: int, opencv_threads: int, torch_threads: int, allow_spinning: bool):
+        self.cores = cores
+        self.workers = workers
+        self.intra_op_threads = intra_op_threads
+        self.opencv_threads = opencv_threads
+        self.torch_threads = torch_threads
+        self.allow_spinning = allow_spinning
+
+    def describe(self) -> str:
+        return f'{len(self.cores)} cores: {self.workers} frame workers x {self.intra_op_threads} onnxruntime threads, {self.opencv_threads} opencv threads, {self.torch_threads} torch threads, spinning {"on" if self.allow_spinning else "off"}'
+
+
+def get_available_cores() -> List[int]:
+    # the affinity mask honours cgroup and taskset limits, the cpu count does not
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def uses_gpu_provider() -> bool:
+    return any(execution_provider != CPU_EXECUTION_PROVIDER for execution_provider in modules.globals.execution_providers)
+
+
+def create_thread_budget(workers: int, cores: Optional[List[int]] = None) -> ThreadBudget:
+    cores = cores or get_available_cores()
+    workers = max(1, workers)
+    if uses_gpu_provider():
+        # the models run on the device, the sessions only need a thread for the host side ops
+        intra_op_threads = 1
+    else:
+        # every worker runs its own inference, so they share the cores instead of each taking all of them
+        intra_op_threads = max(1, len(cores) // workers)
+    # with several workers the frames already run side by side, a per call pool on top only oversubscribes
+    opencv_threads = 1 if workers > 1 else len(cores)
+    if modules.globals.ort_spinning == 'auto':
+        # idle threads spinning for work burn the cores the other workers need
+        allow_spinning = workers == 1 and not uses_gpu_provider()
+    else:
+        allow_spinning = modules.globals.ort_spinning == 'on'
+    return ThreadBudget(cores, workers, intra_op_threads, opencv_threads, intra_op_threads, allow_spinning)
+
+
+def get_worker_thread_budget(thread_budget: ThreadBudget, worker_index: int) -> ThreadBudget:
+    """
+    Budget of one worker process, which handles one frame at a time on its own share of the cores
+    """
+    share = thread_budget.intra_op_threads
+    start = (worker_index * share) % len(thread_budget.cores)
+    cores = thread_budget.cores[start:start + share] or thread_budget.cores
+    return ThreadBudget(cores, 1, thread_budget.intra_op_threads, len(cores), thread_budget.torch_threads, thread_budget.allow_spinning)
+
+
+def apply_thread_budget(thread_budget: ThreadBudget, pin: bool = False) -> None:
+    global THREAD_BUDGET
+
+    THREAD_BUDGET = thread_budget
+    cv2.setNumThreads(thread_budget.opencv_threads)
+    torch.set_num_threads(thread_budget.torch_threads)
+    if pin and hasattr(os, 'sched_setaffinity'):
+        # threads created from now on, including those of the inference sessions, inherit the mask
+        os.sched_setaffinity(0, thread_budget.cores)
+
+
+def get_thread_budget() -> ThreadBudget:
+    if THREAD_BUDGET is None:
+        return create_thread_budget(modules.globals.execution_threads or 1)
+    return THREAD_BUDGET
+
+
+def apply_session_options(session_options: Any) -> Any:
+    thread_budget = get_thread_budget()
+    session_options.intra_op_num_threads = thread_budget.intra_op_threads
+    # the sessions execute sequentially, an inter op pool would only sit idle
+    session_options.inter_op_num_threads = 1
+    allow_spinning = '1' if thread_budget.allow_spinning else '0'
+    session_options.add_session_config_entry('session.intra_op.allow_spinning', allow_spinning)
+    session_options.add_session_config_entry('session.inter_op.allow_spinning', allow_spinning)
+    return session_options
@@ -0,0 +1,115 @@
+import os
+import gc
+import json
+import time
+import atexit
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# enough for hours of video at a few spans per stage and frame, later spans are counted but dropped
+TRACE_EVENT_LIMIT = 4000000
+
+TRACING = False
+TRACE_PATH: Optional[str] = None
+# name, category, start and duration in microseconds, thread id
+TRACE_EVENTS: List[Tuple[str, str, int, int, int]] = []
+TRACE_THREAD_NAMES: Dict[int, str] = {}
+DROPPED_EVENTS = 0
+GC_STARTS: Dict[int, int] = {}
+
+
+def get_timestamp() -> int:
+    return time.perf_counter_ns() // 1000
+
+
+def record(name: str, category: str, start: int, duration: int) -> None:
+    """
+    Keep a complete span, appending a tuple is all a traced call pays while recording
+    """
+    global DROPPED_EVENTS
+
+    if len(TRACE_EVENTS) >= TRACE_EVENT_LIMIT:
+        DROPPED_EVENTS += 1
+        return
+    thread_id = threading.get_ident()
+    if thread_id not in TRACE_THREAD_NAMES:
+        TRACE_THREAD_NAMES[thread_id] = threading.current_thread().name
+    TRACE_EVENTS.append((name, category, start, duration, thread_id))
+
+
+def record_seconds(name: str, category: str, seconds: float) -> None:
+    # spans measured elsewhere end now, so they started the measured time ago
+    if TRACING:
+        duration = int(seconds * 1000000)
+        record(name, category, get_timestamp() - duration, duration)
+
+
+@contextmanager
+def span(name: str, category: str) -> Iterator[None]:
+    if not TRACING:
+        yield
+        return
+    start = get_timestamp()
+    try:
+        yield
+    finally:
+        record(name, category, start, get_timestamp() - start)
+
+
+@contextmanager
+def traced_lock(lock: Any, name: str) -> Iterator[None]:
+    """
+    Hold the lock or semaphore, recording a wait span only when the lock was taken by another thread
+    """
+    if not TRACING:
+        lock.acquire()
+    elif not lock.acquire(blocking=False):
+        start = get_timestamp()
+        lock.acquire()
+        record(f'wait {name}', 'lock', start, get_timestamp() - start)
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def trace_gc(phase: str, info: Dict[str, Any]) -> None:
+    # the collector runs on the thread that triggered it, so the pause lands on that thread
+    thread_id = threading.get_ident()
+    if phase == 'start':
+        GC_STARTS[thread_id] = get_timestamp()
+    elif thread_id in GC_STARTS:
+        start = GC_STARTS.pop(thread_id)
+        record(f'gc generation {info.get("generation")}', 'gc', start, get_timestamp() - start)
+
+
+def start_tracing(trace_path: str) -> None:
+    global TRACING, TRACE_PATH
+
+    TRACE_PATH = trace_path
+    TRACING = True
+    gc.callbacks.append(trace_gc)
+    # jobs end in several ways, quitting from the ui included, the trace is written whichever way it is
+    atexit.register(stop_tracing)
+
+
+def stop_tracing() -> None:
+    global TRACING
+
+    if not TRACING:
+        return
+    TRACING = False
+    if trace_gc in gc.callbacks:
+        gc.callbacks.remove(trace_gc)
+    if TRACE_PATH:
+        write_trace(TRACE_PATH)
+
+
+def write_trace(trace_path: str) -> None:
+    process_id = os.getpid()
+    trace_events: List[Dict[str, Any]] = [{'name': 'thread_name', 'ph': 'M', 'pid': process_id, 'tid': thread_id, 'args': {'name': thread_name}} for thread_id, thread_name in TRACE_THREAD_NAMES.items()]
+    for name, category, start, duration, thread_id in list(TRACE_EVENTS):
+        trace_events.append({'name': name, 'cat': category, 'ph': 'X', 'ts': start, 'dur': duration, 'pid': process_id, 'tid': thread_id})
+    with open(trace_path, 'w') as trace_file:
+        json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms', 'otherData': {'dropped_events': DROPPED_EVENTS}}, trace_file)
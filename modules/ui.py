@@ -1,7 +1,7 @@
 import os
 import webbrowser
 import customtkinter as ctk
-from typing import Callable, Tuple
+from typing import Any, Callable, Tuple
 import cv2
 from cv2_enumerate_cameras import enumerate_cameras  # Add this import
 from PIL import Image, ImageOps
@@ -19,6 +19,7 @@ from modules.face_analyser import (
     simplify_maps,
 )
 from modules.capturer import get_video_frame, get_video_frame_total
+from modules.events import ProgressEvent, StatusEvent, subscribe
 from modules.processors.frame.core import get_frame_processors_modules
 from modules.utilities import (
     is_image,
@@ -78,10 +79,18 @@ def init(start: Callable[[], None], destroy: Callable[[], None]) -> ctk.CTk:
 
     ROOT = create_root(start, destroy)
     PREVIEW = create_preview(ROOT)
+    subscribe(handle_event)
 
     return ROOT
 
 
+def handle_event(event: Any) -> None:
+    if isinstance(event, ProgressEvent):
+        update_status(f'Processing {event.stage}: {event.frame_index}/{event.frame_total} frames ({event.percentage}%)')
+    elif isinstance(event, StatusEvent):
+        update_status(event.message)
+
+
 def save_switch_states():
     switch_states = {
         "keep_fps": modules.globals.keep_fps,
@@ -1,19 +1,30 @@
-import glob
+import json
+import hashlib
 import mimetypes
 import os
 import platform
 import shutil
 import ssl
 import subprocess
+import time
 import urllib
 from pathlib import Path
-from typing import List, Any
+from typing import List, Any, Dict, Iterator, Optional, Tuple
+import numpy
 from tqdm import tqdm
 
 import modules.globals
+from modules.frame_store import TEMP_FRAME_PATTERN, FRAME_CACHE_NAME, get_frame_store, get_frame_name, close_frame_caches
+from modules.metrics import observe
+from modules.tracer import span
+from modules.probe import probe_media
 
 TEMP_FILE = 'temp.mp4'
+TEMP_PREVIEW_FILE = 'preview.mp4'
+PREVIEW_SUFFIX = '.preview.mp4'
+DRAFT_QUALITY = 28
 TEMP_DIRECTORY = 'temp'
+RAM_TEMP_DIRECTORY = 'deep-live-cam'
 
 # monkey patch ssl for mac
 if platform.system().lower() == 'darwin':
@@ -24,33 +35,219 @@ def run_ffmpeg(args: List[str]) -> bool:
     commands = ['ffmpeg', '-hide_banner', '-hwaccel', 'auto', '-loglevel', modules.globals.log_level]
     commands.extend(args)
     try:
-        subprocess.check_output(commands, stderr=subprocess.STDOUT)
+        with span('ffmpeg', 'ffmpeg'):
+            subprocess.check_output(commands, stderr=subprocess.STDOUT)
         return True
     except Exception:
         pass
     return False
 
 
+def open_ffmpeg(args: List[str], stdin: Any = None, stdout: Any = None) -> subprocess.Popen:  # type: ignore[type-arg]
+    commands = ['ffmpeg', '-hide_banner', '-hwaccel', 'auto', '-loglevel', modules.globals.log_level]
+    commands.extend(args)
+    with span('ffmpeg spawn', 'ffmpeg'):
+        return subprocess.Popen(commands, stdin=stdin, stdout=stdout, stderr=subprocess.DEVNULL)
+
+
 def detect_fps(target_path: str) -> float:
-    command = ['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=r_frame_rate', '-of', 'default=noprint_wrappers=1:nokey=1', target_path]
-    output = subprocess.check_output(command).decode().strip().split('/')
     try:
-        numerator, denominator = map(int, output)
-        return numerator / denominator
+        return probe_media(target_path)['fps']
     except Exception:
         pass
     return 30.0
 
 
-def extract_frames(target_path: str) -> None:
-    temp_directory_path = get_temp_directory_path(target_path)
-    run_ffmpeg(['-i', target_path, '-pix_fmt', 'rgb24', os.path.join(temp_directory_path, '%04d.png')])
+def detect_resolution(target_path: str) -> Tuple[int, int]:
+    """
+    Size of the frames as ffmpeg decodes them, rotated videos come out autorotated to their display size
+    """
+    probe = probe_media(target_path)
+    if probe['rotation'] in (90, 270):
+        return probe['height'], probe['width']
+    return probe['width'], probe['height']
+
+
+def open_frame_reader(target_path: str, width: int, height: int, pix_fmt: str = 'bgr24') -> subprocess.Popen:  # type: ignore[type-arg]
+    return open_ffmpeg(['-i', target_path, '-f', 'rawvideo', '-pix_fmt', pix_fmt, '-s', f'{width}x{height}', '-'], stdout=subprocess.PIPE)
+
+
+def open_frame_writer(output_path: str, width: int, height: int, fps: float, audio_path: Optional[str] = None, encoder_args: Optional[List[str]] = None, preview_path: Optional[str] = None, pix_fmt: str = 'bgr24') -> subprocess.Popen:  # type: ignore[type-arg]
+    args = ['-f', 'rawvideo', '-pix_fmt', pix_fmt, '-s', f'{width}x{height}', '-r', str(fps), '-i', '-']
+    if audio_path:
+        args.extend(['-i', audio_path])
+    encoder_args = encoder_args or get_video_encoder_args()
+    if pix_fmt != 'bgr24':
+        # the colorspace filter undoes the rgb conversion of the decoder, frames that stayed in yuv skip it
+        encoder_args, _ = split_video_filter(encoder_args)
+    args.extend(get_output_args(output_path, encoder_args, preview_path, bool(audio_path)))
+    return open_ffmpeg(args, stdin=subprocess.PIPE)
+
+
+def close_frame_writer(writer: subprocess.Popen) -> bool:  # type: ignore[type-arg]
+    try:
+        writer.stdin.close()
+    except OSError:
+        # the encoder exited without reading everything, its exit code tells why
+        pass
+    return writer.wait() == 0
+
+
+def read_raw_frames(reader: subprocess.Popen, width: int, height: int, pix_fmt: str = 'bgr24') -> Iterator[Any]:  # type: ignore[type-arg]
+    # yuv420p frames come as one i420 plane stack, the layout opencv converts from
+    frame_shape = (height * 3 // 2, width) if pix_fmt == 'yuv420p' else (height, width, 3)
+    frame_size = int(numpy.prod(frame_shape))
+    while True:
+        started = time.perf_counter()
+        # bytearray keeps the frame writable for processors that paste in place
+        buffer = bytearray(frame_size)
+        view = memoryview(buffer)
+        offset = 0
+        while offset < frame_size:
+            count = reader.stdout.readinto(view[offset:])
+            if not count:
+                return
+            offset += count
+        # the time spent waiting on the pipe is the time ffmpeg needs to decode the frame
+        observe('decode', time.perf_counter() - started)
+        yield numpy.frombuffer(buffer, dtype=numpy.uint8).reshape(frame_shape)
 
 
-def create_video(target_path: str, fps: float = 30.0) -> None:
+def get_video_encoder_args(video_encoder: Optional[str] = None) -> List[str]:
+    return ['-c:v', video_encoder or modules.globals.video_encoder, '-crf', str(modules.globals.video_quality), '-pix_fmt', 'yuv420p', '-vf', 'colorspace=bt709:iall=bt601-6-625:fast=1']
+
+
+def get_draft_encoder_args() -> List[str]:
+    return ['-c:v', 'libx264', '-preset', 'ultrafast', '-crf', str(DRAFT_QUALITY), '-pix_fmt', 'yuv420p', '-vf', 'colorspace=bt709:iall=bt601-6-625:fast=1']
+
+
+def get_progressive_encoder_args(fps: float) -> List[str]:
+    # a fragment per keyframe and a keyframe per second keep the playable part close behind the encoder
+    return get_video_encoder_args() + ['-g', str(max(1, round(fps))), '-movflags', 'frag_keyframe+empty_moov+default_base_moof']
+
+
+def get_preview_args(preview_path: str, video_map: str, video_filter: Optional[str] = None) -> List[str]:
+    preview_bitrate = modules.globals.preview_bitrate
+    args = ['-map', video_map]
+    if video_filter:
+        args.extend(['-vf', video_filter])
+    # capped bitrate and the moov atom up front so the preview starts playing while it downloads
+    args.extend(['-c:v', 'libx264', '-preset', 'veryfast', '-b:v', preview_bitrate, '-maxrate', preview_bitrate, '-bufsize', preview_bitrate, '-pix_fmt', 'yuv420p', '-movflags', '+faststart', '-an', '-y', preview_path])
+    return args
+
+
+def get_preview_filter() -> str:
+    return f"scale=-2:'min({modules.globals.preview_height},ih)'"
+
+
+def split_video_filter(encoder_args: List[str]) -> Tuple[List[str], Optional[str]]:
+    if '-vf' not in encoder_args:
+        return encoder_args, None
+    filter_index = encoder_args.index('-vf')
+    return encoder_args[:filter_index] + encoder_args[filter_index + 2:], encoder_args[filter_index + 1]
+
+
+def get_output_args(output_path: str, encoder_args: List[str], preview_path: Optional[str] = None, has_audio_input: bool = False) -> List[str]:
+    """
+    Output args of the master and, given a preview path, of a downscaled preview encoded from the same decoded frames
+    """
+    audio_args = ['-map', '1:a:0?', '-c:a', 'copy', '-shortest'] if has_audio_input else []
+    if not preview_path:
+        video_map_args = ['-map', '0:v:0'] if has_audio_input else []
+        return video_map_args + audio_args + encoder_args + ['-y', output_path]
+    # the master filter moves into the filter graph, simple and complex filtering cannot be mixed
+    master_args, master_filter = split_video_filter(encoder_args)
+    filter_complex = f'[0:v]{master_filter or "null"},split=2[master][preview_input];[preview_input]{get_preview_filter()}[preview]'
+    return ['-filter_complex', filter_complex, '-map', '[master]'] + audio_args + master_args + ['-y', output_path] + get_preview_args(preview_path, '[preview]')
+
+
+def extract_frames(target_path: str) -> None:
+    temp_directory_path = get_temp_directory_path(target_path)
+    frame_store = get_frame_store()
+    spill_directory_path = get_spill_directory_path(target_path)
+    if spill_directory_path:
+        extract_frames_with_spill(target_path, temp_directory_path, spill_directory_path, frame_store)
+        return
+    extract_args = frame_store.get_extract_args()
+    if extract_args is None:
+        extract_frames_through_pipe(target_path, temp_directory_path, frame_store)
+        return
+    run_ffmpeg(['-i', target_path] + extract_args + [os.path.join(temp_directory_path, TEMP_FRAME_PATTERN + frame_store.extension)])
+
+
+def extract_frames_through_pipe(target_path: str, temp_directory_path: str, frame_store: Any) -> None:
+    width, height = detect_resolution(target_path)
+    reader = open_frame_reader(target_path, width, height)
+    try:
+        frame_store.write_all(temp_directory_path, read_raw_frames(reader, width, height), width, height)
+    finally:
+        reader.stdout.close()
+        reader.wait()
+
+
+def extract_frames_with_spill(target_path: str, temp_directory_path: str, spill_directory_path: str, frame_store: Any) -> None:
+    """
+    Keep frames in ram while they fit the budget and spill the rest to disk behind symlinks
+    """
+    ram_budget = get_ram_budget(temp_directory_path)
+    width, height = detect_resolution(target_path)
+    if frame_store.name == 'raw':
+        # the frame cache is a single file, it lives either in ram or on disk as a whole
+        if width * height * 3 * probe_media(target_path)['frame_count'] > ram_budget:
+            link_spill_path(os.path.join(temp_directory_path, FRAME_CACHE_NAME), spill_directory_path)
+        extract_frames_through_pipe(target_path, temp_directory_path, frame_store)
+        return
+    reader = open_frame_reader(target_path, width, height)
+    ram_usage = 0
+    try:
+        for frame_number, frame in enumerate(read_raw_frames(reader, width, height), start=1):
+            temp_frame_path = os.path.join(temp_directory_path, get_frame_name(frame_number, frame_store))
+            if ram_usage < ram_budget:
+                frame_store.write(temp_frame_path, frame)
+                ram_usage += os.path.getsize(temp_frame_path)
+            else:
+                frame_store.write(link_spill_path(temp_frame_path, spill_directory_path), frame)
+    finally:
+        reader.stdout.close()
+        reader.wait()
+
+
+def link_spill_path(temp_path: str, spill_directory_path: str) -> str:
+    # processors keep reading and writing the ram path, the symlink sends the bytes to disk
+    os.makedirs(spill_directory_path, exist_ok=True)
+    spill_path = os.path.join(spill_directory_path, os.path.basename(temp_path))
+    if os.path.lexists(temp_path):
+        os.remove(temp_path)
+    os.symlink(spill_path, temp_path)
+    return spill_path
+
+
+def create_video(target_path: str, fps: float = 30.0) -> bool:
     temp_output_path = get_temp_output_path(target_path)
     temp_directory_path = get_temp_directory_path(target_path)
-    run_ffmpeg(['-r', str(fps), '-i', os.path.join(temp_directory_path, '%04d.png'), '-c:v', modules.globals.video_encoder, '-crf', str(modules.globals.video_quality), '-pix_fmt', 'yuv420p', '-vf', 'colorspace=bt709:iall=bt601-6-625:fast=1', '-y', temp_output_path])
+    frame_store = get_frame_store()
+    encode_args = frame_store.get_encode_args(temp_directory_path, fps)
+    if encode_args is None:
+        return create_video_through_pipe(target_path, fps, frame_store)
+    return run_ffmpeg(encode_args + get_output_args(temp_output_path, get_video_encoder_args(), get_temp_preview_path(target_path)))
+
+
+def create_video_through_pipe(target_path: str, fps: float, frame_store: Any) -> bool:
+    temp_frame_paths = get_temp_frame_paths(target_path)
+    if not temp_frame_paths:
+        return False
+    height, width = frame_store.read(temp_frame_paths[0]).shape[:2]
+    writer = open_frame_writer(get_temp_output_path(target_path), width, height, fps, preview_path=get_temp_preview_path(target_path))
+    written = False
+    try:
+        for temp_frame_path in temp_frame_paths:
+            writer.stdin.write(numpy.ascontiguousarray(frame_store.read(temp_frame_path)).tobytes())
+        written = True
+    except BrokenPipeError:
+        pass
+    finally:
+        encoded = close_frame_writer(writer)
+    return written and encoded
 
 
 def restore_audio(target_path: str, output_path: str) -> None:
@@ -58,24 +255,77 @@ def restore_audio(target_path: str, output_path: str) -> None:
     done = run_ffmpeg(['-i', temp_output_path, '-i', target_path, '-c:v', 'copy', '-map', '0:v:0', '-map', '1:a:0', '-y', output_path])
     if not done:
         move_temp(target_path, output_path)
+    else:
+        move_temp_preview(target_path, output_path)
 
 
 def get_temp_frame_paths(target_path: str) -> List[str]:
     temp_directory_path = get_temp_directory_path(target_path)
-    return glob.glob((os.path.join(glob.escape(temp_directory_path), '*.png')))
+    return get_frame_store().list_frames(temp_directory_path)
 
 
-def get_temp_directory_path(target_path: str) -> str:
+def get_ram_temp_root() -> Optional[str]:
+    ram_temp_path = modules.globals.temp_ram_path
+    if modules.globals.temp_store == 'ram' and ram_temp_path and os.path.isdir(ram_temp_path) and os.access(ram_temp_path, os.W_OK):
+        return ram_temp_path
+    return None
+
+
+def get_disk_temp_directory_path(target_path: str) -> str:
     target_name, _ = os.path.splitext(os.path.basename(target_path))
     target_directory_path = os.path.dirname(target_path)
     return os.path.join(target_directory_path, TEMP_DIRECTORY, target_name)
 
 
+def get_temp_directory_path(target_path: str) -> str:
+    ram_temp_root = get_ram_temp_root()
+    if ram_temp_root is None:
+        return get_disk_temp_directory_path(target_path)
+    target_name, _ = os.path.splitext(os.path.basename(target_path))
+    # hash the target directory so targets with the same name do not share temp frames
+    target_directory_hash = hashlib.sha1(os.path.abspath(os.path.dirname(target_path)).encode()).hexdigest()[:8]
+    return os.path.join(ram_temp_root, RAM_TEMP_DIRECTORY, target_directory_hash, target_name)
+
+
+def get_spill_directory_path(target_path: str) -> Optional[str]:
+    if get_ram_temp_root() is None:
+        return None
+    return get_disk_temp_directory_path(target_path)
+
+
+def get_ram_budget(temp_directory_path: str) -> int:
+    ram_budget = int(modules.globals.temp_ram_budget * 1024 ** 3)
+    # leave headroom on the tmpfs, it is shared with the rest of the system
+    return min(ram_budget, int(shutil.disk_usage(temp_directory_path).free * 0.9))
+
+
+def get_temp_store_status(target_path: str) -> str:
+    temp_directory_path = get_temp_directory_path(target_path)
+    spill_directory_path = get_spill_directory_path(target_path)
+    if spill_directory_path is None:
+        if modules.globals.temp_store == 'ram':
+            return f'RAM temp path {modules.globals.temp_ram_path} is unavailable, using temp frames on disk at {temp_directory_path}'
+        return f'Using temp frames on disk at {temp_directory_path}'
+    spill_count = len(os.listdir(spill_directory_path)) if os.path.isdir(spill_directory_path) else 0
+    return f'Using temp frames in RAM at {temp_directory_path}, {spill_count} spilled to {spill_directory_path}'
+
+
 def get_temp_output_path(target_path: str) -> str:
     temp_directory_path = get_temp_directory_path(target_path)
     return os.path.join(temp_directory_path, TEMP_FILE)
 
 
+def get_temp_preview_path(target_path: str) -> Optional[str]:
+    if not modules.globals.preview_rendition:
+        return None
+    return os.path.join(get_temp_directory_path(target_path), TEMP_PREVIEW_FILE)
+
+
+def get_preview_path(output_path: str) -> str:
+    output_name, _ = os.path.splitext(output_path)
+    return output_name + PREVIEW_SUFFIX
+
+
 def normalize_output_path(source_path: str, target_path: str, output_path: str) -> Any:
     if source_path and target_path:
         source_name, _ = os.path.splitext(os.path.basename(source_path))
@@ -96,21 +346,36 @@ def move_temp(target_path: str, output_path: str) -> None:
         if os.path.isfile(output_path):
             os.remove(output_path)
         shutil.move(temp_output_path, output_path)
+    move_temp_preview(target_path, output_path)
+
+
+def move_temp_preview(target_path: str, output_path: str) -> None:
+    temp_preview_path = get_temp_preview_path(target_path)
+    if temp_preview_path and os.path.isfile(temp_preview_path):
+        shutil.move(temp_preview_path, get_preview_path(output_path))
 
 
 def clean_temp(target_path: str) -> None:
-    temp_directory_path = get_temp_directory_path(target_path)
-    parent_directory_path = os.path.dirname(temp_directory_path)
-    if not modules.globals.keep_frames and os.path.isdir(temp_directory_path):
-        shutil.rmtree(temp_directory_path)
-    if os.path.exists(parent_directory_path) and not os.listdir(parent_directory_path):
-        os.rmdir(parent_directory_path)
+    close_frame_caches()
+    # the ram directory only holds symlinks to the spilled frames, both have to go
+    for temp_directory_path in [get_temp_directory_path(target_path), get_spill_directory_path(target_path)]:
+        if temp_directory_path is None:
+            continue
+        parent_directory_path = os.path.dirname(temp_directory_path)
+        if not modules.globals.keep_frames and os.path.isdir(temp_directory_path):
+            shutil.rmtree(temp_directory_path)
+        if os.path.exists(parent_directory_path) and not os.listdir(parent_directory_path):
+            os.rmdir(parent_directory_path)
 
 
 def has_image_extension(image_path: str) -> bool:
     return image_path.lower().endswith(('png', 'jpg', 'jpeg'))
 
 
+def has_gif_extension(image_path: str) -> bool:
+    return image_path.lower().endswith('gif')
+
+
 def is_image(image_path: str) -> bool:
     if image_path and os.path.isfile(image_path):
         mimetype, _ = mimetypes.guess_type(image_path)
@@ -125,6 +390,24 @@ def is_video(video_path: str) -> bool:
     return False
 
 
+def get_globals_snapshot() -> Dict[str, Any]:
+    snapshot = {}
+    for key, value in vars(modules.globals).items():
+        if key.startswith('_') or key.isupper():
+            continue
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            continue
+        snapshot[key] = value
+    return snapshot
+
+
+def apply_globals_snapshot(snapshot: Dict[str, Any]) -> None:
+    for key, value in snapshot.items():
+        setattr(modules.globals, key, value)
+
+
 def conditional_download(download_directory_path: str, urls: List[str]) -> None:
     if not os.path.exists(download_directory_path):
         os.makedirs(download_directory_path)
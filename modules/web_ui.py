@@ -8,9 +8,10 @@ from flask import Flask, render_template, request, jsonify, send_file, redirect,
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from PIL import Image
-import cv2
 import threading
 import time
+import datetime
+from tqdm import tqdm
 
 import modules.globals
 import modules.metadata
@@ -23,12 +24,19 @@ from modules.face_analyser import (
     simplify_maps,
 )
 from modules.capturer import get_video_frame, get_video_frame_total
+from modules.events import ProgressEvent, StatusEvent, subscribe, publish_status
+from modules.metrics import render_prometheus
+from modules.estimator import estimate_job, format_estimate
+from modules.probe import probe_thumbnail
+from modules.segments import parse_time_ranges
 from modules.processors.frame.core import get_frame_processors_modules
 from modules.utilities import (
     is_image,
     is_video,
     resolve_relative_path,
     has_image_extension,
+    get_preview_path,
+    get_temp_output_path,
 )
 
 app = Flask(__name__, template_folder='../templates', static_folder='../static')
@@ -71,6 +79,23 @@ def get_video_stream(file_path):
     return Response(generate(), mimetype='video/mp4', 
                    headers={'Accept-Ranges': 'bytes'})
 
+def get_live_stream(file_path):
+    """Follow an output video that is still being written"""
+    target_path = modules.globals.target_path
+    def generate():
+        with open(file_path, 'rb') as f:
+            while True:
+                data = f.read(1024 * 1024)
+                if data:
+                    yield data
+                    continue
+                # drained the file, stop once the encoder has finished or moved on to the next target
+                if not (processing_thread and processing_thread.is_alive()) or modules.globals.target_path != target_path or not os.path.exists(file_path):
+                    break
+                time.sleep(0.5)
+    
+    return Response(generate(), mimetype='video/mp4')
+
 def save_switch_states():
     switch_states = {
         "keep_fps": modules.globals.keep_fps,
@@ -119,46 +144,41 @@ def image_to_base64(image_path):
         return None
 
 def update_status(message: str, scope: str = 'WEB') -> None:
-    """Update processing status for web interface"""
+    """Publish a status message of the web interface"""
+    print(f'[{scope}] {message}')
+    publish_status(message, scope)
+
+def handle_event(event) -> None:
+    """Update processing status for web interface from progress and status events"""
     global processing_status
     
-    # Parse progress information from video processing output
-    import re
-    progress_match = re.search(r'(\d+)%\|[▏▎▍▌▋▊▉█\s]*\|\s*(\d+)/(\d+)\s*\[([^\]]+)<([^\]]+),\s*([^,]+),\s*execution_providers=([^\]]+)\]', message)
-    
-    if progress_match:
-        percentage = int(progress_match.group(1))
-        current_frame = int(progress_match.group(2))
-        total_frames = int(progress_match.group(3))
-        elapsed_time = progress_match.group(4)
-        remaining_time = progress_match.group(5)
-        frame_rate = progress_match.group(6)
-        execution_provider = progress_match.group(7)
+    timestamp = datetime.datetime.fromtimestamp(event.timestamp).strftime("%H:%M:%S")
+    if isinstance(event, ProgressEvent):
+        elapsed_time = tqdm.format_interval(event.elapsed)
+        remaining_time = tqdm.format_interval(event.remaining)
+        frame_rate = f"{event.seconds_per_frame:.2f}s/frame"
         
         # Update progress with detailed video information
-        processing_status["progress"] = percentage
-        processing_status["message"] = f"Processing video: {current_frame}/{total_frames} frames ({percentage}%)"
+        processing_status["progress"] = event.percentage
+        processing_status["message"] = f"Processing video: {event.frame_index}/{event.frame_total} frames ({event.percentage}%)"
         processing_status["video_progress"] = {
-            "current_frame": current_frame,
-            "total_frames": total_frames,
+            "job_id": event.job_id,
+            "stage": event.stage,
+            "current_frame": event.frame_index,
+            "total_frames": event.frame_total,
+            "reused_frames": event.reused,
             "elapsed_time": elapsed_time,
             "remaining_time": remaining_time,
             "frame_rate": frame_rate,
-            "execution_provider": execution_provider.strip("'[]")
+            "execution_provider": ", ".join(modules.globals.execution_providers)
         }
         
         # Add detailed log entry with video progress
-        import datetime
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
-        detailed_message = f"[{timestamp}] [VIDEO-PROGRESS] 🎬 Frame {current_frame}/{total_frames} ({percentage}%) | ⏱️ {elapsed_time}<{remaining_time} | 🚀 {frame_rate}"
+        detailed_message = f"[{timestamp}] [VIDEO-PROGRESS] 🎬 Frame {event.frame_index}/{event.frame_total} ({event.percentage}%) | ⏱️ {elapsed_time}<{remaining_time} | 🚀 {frame_rate}"
         processing_status["detailed_logs"].append(detailed_message)
-    else:
+    elif isinstance(event, StatusEvent):
         # Regular status update
-        processing_status["message"] = message
-        
-        # Add detailed log entry with timestamp
-        import datetime
-        timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+        processing_status["message"] = event.message
         
         # Add emoji indicators based on scope
         emoji_map = {
@@ -169,16 +189,14 @@ def update_status(message: str, scope: str = 'WEB') -> None:
             'WEB': '🌐',
             'DLC.FACE-SWAPPER': '🎭'
         }
-        emoji = emoji_map.get(scope, '📝')
+        emoji = emoji_map.get(event.scope, '📝')
         
-        detailed_message = f"[{timestamp}] [{scope}] {emoji} {message}"
+        detailed_message = f"[{timestamp}] [{event.scope}] {emoji} {event.message}"
         processing_status["detailed_logs"].append(detailed_message)
     
     # Keep only last 50 log entries to prevent memory bloat
     if len(processing_status["detailed_logs"]) > 50:
         processing_status["detailed_logs"] = processing_status["detailed_logs"][-50:]
-    
-    print(f'[{scope}] {message}')
 
 @app.route('/')
 def index():
@@ -215,14 +233,9 @@ def upload_file():
                 preview_data = image_to_base64(filepath)
             elif is_video(filepath):
                 # Generate video thumbnail
-                cap = cv2.VideoCapture(filepath)
-                ret, frame = cap.read()
-                if ret:
-                    temp_img_path = f"{filepath}_thumb.jpg"
-                    cv2.imwrite(temp_img_path, frame)
-                    preview_data = image_to_base64(temp_img_path)
-                    os.remove(temp_img_path)
-                cap.release()
+                thumbnail = probe_thumbnail(filepath)
+                if thumbnail:
+                    preview_data = base64.b64encode(thumbnail).decode('utf-8')
             
             file_info = {
                 'id': len(uploaded_sources) + len(uploaded_targets),
@@ -316,6 +329,20 @@ def update_settings():
         modules.globals.nsfw_filter = data['nsfw_filter']
     if 'face_enhancer' in data:
         modules.globals.fp_ui['face_enhancer'] = data['face_enhancer']
+    if 'face_prescan' in data:
+        modules.globals.face_prescan = data['face_prescan']
+    if 'frame_dedup' in data:
+        modules.globals.frame_dedup = data['frame_dedup']
+    if 'progressive_output' in data:
+        modules.globals.progressive_output = data['progressive_output']
+    if data.get('video_pipeline') in ('frames', 'stream', 'yuv'):
+        modules.globals.video_pipeline = data['video_pipeline']
+    if data.get('temp_frame_format') in ('png', 'bmp', 'jpg', 'npy', 'raw'):
+        modules.globals.temp_frame_format = data['temp_frame_format']
+    if data.get('temp_store') in ('disk', 'ram'):
+        modules.globals.temp_store = data['temp_store']
+    if 'temp_ram_budget' in data:
+        modules.globals.temp_ram_budget = float(data['temp_ram_budget'])
     
     save_switch_states()
     return jsonify({'success': True})
@@ -330,7 +357,14 @@ def get_settings():
         'many_faces': modules.globals.many_faces,
         'map_faces': modules.globals.map_faces,
         'nsfw_filter': modules.globals.nsfw_filter,
-        'face_enhancer': modules.globals.fp_ui.get('face_enhancer', False)
+        'face_enhancer': modules.globals.fp_ui.get('face_enhancer', False),
+        'face_prescan': modules.globals.face_prescan,
+        'frame_dedup': modules.globals.frame_dedup,
+        'progressive_output': modules.globals.progressive_output,
+        'video_pipeline': modules.globals.video_pipeline,
+        'temp_frame_format': modules.globals.temp_frame_format,
+        'temp_store': modules.globals.temp_store,
+        'temp_ram_budget': modules.globals.temp_ram_budget
     })
 
 @app.route('/process', methods=['POST'])
@@ -344,6 +378,21 @@ def start_processing():
     if processing_thread and processing_thread.is_alive():
         return jsonify({'error': 'Processing already in progress'}), 400
     
+    # Optional time ranges to process, everything else is stream copied
+    data = request.get_json(silent=True) or {}
+    try:
+        modules.globals.video_ranges = parse_time_ranges(data.get('start'), data.get('end'), data.get('ranges'))
+    except ValueError:
+        return jsonify({'error': 'Invalid time range'}), 400
+    # a draft renders a quick low resolution preview of the whole video
+    modules.globals.draft = bool(data.get('draft', False))
+    if 'draft_height' in data:
+        modules.globals.draft_height = int(data['draft_height'])
+    if 'draft_stride' in data:
+        modules.globals.draft_stride = int(data['draft_stride'])
+    # an estimate samples a few frames of every target before it is rendered
+    run_estimate = bool(data.get('estimate', False))
+    
     # Reset batch results
     batch_results = []
     
@@ -384,6 +433,12 @@ def start_processing():
                 update_status(f"🎯 Processing: {target_file['original_name']} ({i+1}/{total_targets})", "PROCESS")
                 update_status(f"💾 Output will be saved as: {output_filename}", "PROCESS")
                 
+                if run_estimate:
+                    job_estimate = estimate_job(source_file['filepath'], target_file['filepath'], get_frame_processors_modules(modules.globals.frame_processors))
+                    processing_status.setdefault("estimates", []).append(job_estimate)
+                    for line in format_estimate(job_estimate):
+                        update_status(line, "ESTIMATE")
+                
                 # Process current file
                 from modules.core import start
                 start()
@@ -397,14 +452,9 @@ def start_processing():
                         preview_data = image_to_base64(modules.globals.output_path)
                     elif is_video(modules.globals.output_path):
                         # Generate video thumbnail
-                        cap = cv2.VideoCapture(modules.globals.output_path)
-                        ret, frame = cap.read()
-                        if ret:
-                            temp_img_path = f"{modules.globals.output_path}_preview.jpg"
-                            cv2.imwrite(temp_img_path, frame)
-                            preview_data = image_to_base64(temp_img_path)
-                            os.remove(temp_img_path)
-                        cap.release()
+                        thumbnail = probe_thumbnail(modules.globals.output_path)
+                        if thumbnail:
+                            preview_data = base64.b64encode(thumbnail).decode('utf-8')
                 
                 # Store result
                 batch_results.append({
@@ -446,6 +496,37 @@ def get_status():
     """Get current processing status"""
     return jsonify(processing_status)
 
+@app.route('/estimate', methods=['POST'])
+def estimate_processing():
+    """Estimate time, temp frames and memory of processing the uploaded targets without rendering them"""
+    if not uploaded_sources or not uploaded_targets:
+        return jsonify({'error': 'Please upload both source and target files'}), 400
+    
+    if processing_thread and processing_thread.is_alive():
+        return jsonify({'error': 'Processing already in progress'}), 400
+    
+    frame_processors = get_frame_processors_modules(modules.globals.frame_processors)
+    try:
+        estimates = [estimate_job(uploaded_sources[0]['filepath'], target_file['filepath'], frame_processors) for target_file in uploaded_targets]
+    except Exception as e:
+        return jsonify({'error': f'Estimate failed: {str(e)}'}), 500
+    return jsonify({'success': True, 'estimates': estimates, 'summary': [format_estimate(estimate) for estimate in estimates]})
+
+@app.route('/metrics')
+def get_metrics():
+    """Stage timings, queue depths, busy workers and memory in the prometheus text format"""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/live')
+def live_output():
+    """Stream the fragmented output of the video being processed"""
+    if not modules.globals.progressive_output or not modules.globals.target_path:
+        return jsonify({'error': 'Progressive output is disabled'}), 404
+    temp_output_path = get_temp_output_path(modules.globals.target_path)
+    if not os.path.exists(temp_output_path):
+        return jsonify({'error': 'No output is being written'}), 404
+    return get_live_stream(temp_output_path)
+
 @app.route('/results')
 def get_batch_results():
     """Get batch processing results"""
@@ -547,6 +628,10 @@ def preview_file(filename):
     
     # For video files, use streaming for better performance
     if filename.lower().endswith(('.mp4', '.avi', '.mov', '.mkv')):
+        # serve the small rendition unless the master is asked for
+        preview_path = get_preview_path(file_path)
+        if request.args.get('rendition') != 'master' and os.path.exists(preview_path):
+            return get_video_stream(preview_path)
         return get_video_stream(file_path)
     elif filename.lower().endswith(('.jpg', '.jpeg', '.png', '.gif')):
         return send_file(file_path, mimetype='image/jpeg')
@@ -562,9 +647,8 @@ def init_web(start_func: Callable[[], None], destroy_func: Callable[[], None], h
     print(f"Starting Deep Live Cam Web Interface")
     print(f"Open your browser and go to: http://{host}:{port}")
     
-    # Override the update_status function in core module
-    import modules.core
-    modules.core.update_status = update_status
+    # Follow the progress and status events of every job
+    subscribe(handle_event)
     
     try:
         app.run(host=host, port=port, debug=False, threaded=True)
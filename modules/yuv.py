@@ -0,0 +1,90 @@
+from typing import Any, List, Tuple
+
+import cv2
+import numpy
+
+import modules.globals
+from modules.custom_types import Frame
+from modules.face_presence import detect_face_boxes
+
+ROI_MARGIN = 0.5
+# keeps every roi on whole chroma samples and its i420 layout rectangular
+ROI_ALIGNMENT = 4
+
+Planes = Tuple[Any, Any, Any]
+Roi = Tuple[int, int, int, int]
+
+
+def get_yuv_planes(frame: Frame, width: int, height: int) -> Planes:
+    """
+    Return writable views of the y, u and v planes of an i420 frame
+    """
+    flat_frame = frame.reshape(-1)
+    luma_size = width * height
+    chroma_shape = (height // 2, width // 2)
+    return flat_frame[:luma_size].reshape(height, width), flat_frame[luma_size:luma_size * 5 // 4].reshape(chroma_shape), flat_frame[luma_size * 5 // 4:].reshape(chroma_shape)
+
+
+def align_down(value: float) -> int:
+    return int(value) // ROI_ALIGNMENT * ROI_ALIGNMENT
+
+
+def align_up(value: float) -> int:
+    return -(-int(numpy.ceil(value)) // ROI_ALIGNMENT) * ROI_ALIGNMENT
+
+
+def merge_rois(rois: List[Roi]) -> List[Roi]:
+    # overlapping rois are processed as one, otherwise a face could be swapped twice
+    merged_rois: List[Roi] = []
+    for roi in rois:
+        while True:
+            overlapping_roi = next((other for other in merged_rois if roi[0] < other[2] and other[0] < roi[2] and roi[1] < other[3] and other[1] < roi[3]), None)
+            if overlapping_roi is None:
+                break
+            merged_rois.remove(overlapping_roi)
+            roi = (min(roi[0], overlapping_roi[0]), min(roi[1], overlapping_roi[1]), max(roi[2], overlapping_roi[2]), max(roi[3], overlapping_roi[3]))
+        merged_rois.append(roi)
+    return merged_rois
+
+
+def get_face_rois(planes: Planes, width: int, height: int) -> List[Roi]:
+    y_plane, u_plane, v_plane = planes
+    # detect at half resolution, where the chroma planes need no upsampling
+    small_luma = cv2.resize(y_plane, (width // 2, height // 2), interpolation=cv2.INTER_AREA)
+    small_frame = cv2.cvtColor(cv2.merge([small_luma, u_plane, v_plane]), cv2.COLOR_YUV2BGR)
+    bboxes = sorted(detect_face_boxes(small_frame), key=lambda bbox: bbox[0])
+    if not modules.globals.many_faces:
+        bboxes = bboxes[:1]
+    right_limit = align_down(width)
+    bottom_limit = align_down(height)
+    rois = []
+    for bbox in bboxes:
+        left, top, right, bottom = (bbox[:4] * 2).tolist()
+        # the processors detect again inside the roi and need the whole head to do so
+        margin = max(right - left, bottom - top) * ROI_MARGIN
+        roi = (align_down(max(0.0, left - margin)), align_down(max(0.0, top - margin)), min(right_limit, align_up(right + margin)), min(bottom_limit, align_up(bottom + margin)))
+        if roi[0] < roi[2] and roi[1] < roi[3]:
+            rois.append(roi)
+    return merge_rois(rois)
+
+
+def read_yuv_roi(planes: Planes, roi: Roi) -> Frame:
+    y_plane, u_plane, v_plane = planes
+    left, top, right, bottom = roi
+    chroma_roi = (slice(top // 2, bottom // 2), slice(left // 2, right // 2))
+    i420_roi = numpy.concatenate([y_plane[top:bottom, left:right].reshape(-1), u_plane[chroma_roi].reshape(-1), v_plane[chroma_roi].reshape(-1)])
+    return cv2.cvtColor(i420_roi.reshape((bottom - top) * 3 // 2, right - left), cv2.COLOR_YUV2BGR_I420)
+
+
+def write_yuv_roi(planes: Planes, roi: Roi, roi_frame: Frame) -> None:
+    y_plane, u_plane, v_plane = planes
+    left, top, right, bottom = roi
+    roi_width = right - left
+    roi_height = bottom - top
+    luma_size = roi_width * roi_height
+    chroma_shape = (roi_height // 2, roi_width // 2)
+    chroma_roi = (slice(top // 2, bottom // 2), slice(left // 2, right // 2))
+    i420_roi = cv2.cvtColor(roi_frame, cv2.COLOR_BGR2YUV_I420).reshape(-1)
+    y_plane[top:bottom, left:right] = i420_roi[:luma_size].reshape(roi_height, roi_width)
+    u_plane[chroma_roi] = i420_roi[luma_size:luma_size * 5 // 4].reshape(chroma_shape)
+    v_plane[chroma_roi] = i420_roi[luma_size * 5 // 4:].reshape(chroma_shape)
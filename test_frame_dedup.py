@@ -0,0 +1,49 @@
+import numpy
+
+from modules.frame_dedup import DuplicateFrameDetector
+
+
+def create_frame() -> numpy.ndarray:
+    frame = numpy.full((1080, 1920, 3), 128, dtype=numpy.uint8)
+    # a face sized patch with some structure, so the frame is not flat
+    frame[400:600, 860:1060] = 180
+    return frame
+
+
+def test_static_frames_are_duplicates():
+    detector = DuplicateFrameDetector(0.5)
+    frame = create_frame()
+    assert not detector.is_duplicate(frame)
+    assert detector.is_duplicate(frame.copy())
+
+
+def test_sensor_noise_is_duplicate():
+    detector = DuplicateFrameDetector(0.5)
+    frame = create_frame()
+    noise = numpy.random.default_rng(0).normal(0, 1, frame.shape)
+    noisy_frame = numpy.clip(numpy.rint(frame + noise), 0, 255).astype(numpy.uint8)
+    assert not detector.is_duplicate(frame)
+    assert detector.is_duplicate(noisy_frame)
+
+
+def test_small_moving_patch_is_not_duplicate():
+    detector = DuplicateFrameDetector(0.5)
+    frame = create_frame()
+    assert not detector.is_duplicate(frame)
+    # a mouth sized region opening inside the face
+    moved_frame = frame.copy()
+    moved_frame[540:560, 940:980] = 60
+    assert not detector.is_duplicate(moved_frame)
+
+
+def test_slow_drift_is_not_duplicate():
+    detector = DuplicateFrameDetector(0.5)
+    frame = create_frame()
+    assert not detector.is_duplicate(frame)
+    # every step is small, the distance to the reference of the run keeps growing
+    duplicates = []
+    for step in range(1, 6):
+        moved_frame = frame.copy()
+        moved_frame[540:560, 940:940 + step * 8] = 60
+        duplicates.append(detector.is_duplicate(moved_frame))
+    assert not all(duplicates)
@@ -0,0 +1,35 @@
+import os
+
+import numpy
+
+from modules.frame_store import get_frame_store
+from modules.utilities import link_spill_path
+
+
+def create_frame(value: int) -> numpy.ndarray:
+    return numpy.full((64, 64, 3), value, dtype=numpy.uint8)
+
+
+def test_write_replaces_frame(tmp_path):
+    frame_store = get_frame_store('npy')
+    frame_path = str(tmp_path / '000001.npy')
+    frame_store.write(frame_path, create_frame(10))
+    frame_store.write(frame_path, create_frame(20))
+    assert numpy.array_equal(frame_store.read(frame_path), create_frame(20))
+    # the partial file is renamed into place, nothing is left next to the frame
+    assert os.listdir(tmp_path) == ['000001.npy']
+
+
+def test_write_keeps_spill_symlink(tmp_path):
+    frame_store = get_frame_store('npy')
+    ram_directory_path = tmp_path / 'ram'
+    ram_directory_path.mkdir()
+    frame_path = str(ram_directory_path / '000001.npy')
+    spill_path = link_spill_path(frame_path, str(tmp_path / 'spill'))
+    frame_store.write(spill_path, create_frame(10))
+
+    frame_store.write(frame_path, create_frame(20))
+    assert os.path.islink(frame_path)
+    assert os.path.realpath(frame_path) == os.path.realpath(spill_path)
+    assert numpy.array_equal(frame_store.read(spill_path), create_frame(20))
+    assert os.listdir(ram_directory_path) == ['000001.npy']
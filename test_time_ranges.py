@@ -0,0 +1,65 @@
+import pytest
+
+from modules.segments import parse_time, parse_time_ranges, snap_time_ranges, is_in_time_ranges
+
+
+def test_parse_time_formats():
+    assert parse_time('90') == 90.0
+    assert parse_time('1:30') == 90.0
+    assert parse_time('1:00:30.5') == 3630.5
+    assert parse_time(' 2.5 ') == 2.5
+
+
+def test_parse_time_accepts_numbers():
+    assert parse_time(90) == 90.0
+    assert parse_time(2.5) == 2.5
+
+
+def test_parse_time_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_time('abc')
+
+
+def test_parse_time_ranges_start_and_end():
+    assert parse_time_ranges('10', '20') == [[10.0, 20.0]]
+    assert parse_time_ranges('10') == [[10.0, float('inf')]]
+    assert parse_time_ranges(end='1:00') == [[0.0, 60.0]]
+    assert parse_time_ranges(10, 20.5) == [[10.0, 20.5]]
+
+
+def test_parse_time_ranges_list_is_sorted():
+    assert parse_time_ranges(ranges='1:00-1:15, 10-30') == [[10.0, 30.0], [60.0, 75.0]]
+    assert parse_time_ranges(ranges='-5,50-') == [[0.0, 5.0], [50.0, float('inf')]]
+
+
+def test_parse_time_ranges_nothing_requested():
+    assert parse_time_ranges() == []
+    assert parse_time_ranges('', '', '') == []
+
+
+def test_parse_time_ranges_rejects_inverted_ranges():
+    with pytest.raises(ValueError):
+        parse_time_ranges(ranges='30-10')
+    with pytest.raises(ValueError):
+        parse_time_ranges('20', '20')
+
+
+def test_snap_time_ranges_widens_to_keyframes():
+    keyframes = [0.0, 2.0, 4.0, 6.0, 8.0]
+    assert snap_time_ranges([[3.0, 5.0]], keyframes, 10.0) == [(2.0, 6.0)]
+    assert snap_time_ranges([[4.0, 6.0]], keyframes, 10.0) == [(4.0, 8.0)]
+
+
+def test_snap_time_ranges_merges_overlaps():
+    keyframes = [0.0, 2.0, 4.0, 6.0, 8.0]
+    assert snap_time_ranges([[1.0, 3.0], [3.5, 5.0]], keyframes, 10.0) == [(0.0, 6.0)]
+    assert snap_time_ranges([[1.0, 1.5], [7.0, 7.5]], keyframes, 10.0) == [(0.0, 2.0), (6.0, 8.0)]
+
+
+def test_snap_time_ranges_clamps_to_duration():
+    assert snap_time_ranges([[7.0, float('inf')]], [0.0, 2.0, 4.0, 6.0, 8.0], 10.0) == [(6.0, 10.0)]
+
+
+def test_is_in_time_ranges():
+    assert is_in_time_ranges(50, 25.0, [[2.0, 3.0]])
+    assert not is_in_time_ranges(75, 25.0, [[2.0, 3.0]])